@@ -1,23 +1,144 @@
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from google.auth.transport.requests import Request
-import os, pickle
+from datetime import datetime, timedelta
+import os, pickle, threading, queue, time, logging
+
+logger = logging.getLogger(__name__)
 
 SCOPES = ['https://www.googleapis.com/auth/calendar']
+TOKEN_PATH = 'token.pickle'
+# refresh a little ahead of expiry so requests never go out with a stale token
+REFRESH_MARGIN = timedelta(minutes=5)
 
-def get_calendar_service():
+# process-wide cached credentials and service, guarded by _lock
+_creds = None
+_service = None
+_lock = threading.Lock()
+
+def _save_credentials(creds):
+    with open(TOKEN_PATH, 'wb') as token:
+        pickle.dump(creds, token)
+
+def _load_credentials():
     creds = None
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
+    if os.path.exists(TOKEN_PATH):
+        with open(TOKEN_PATH, 'rb') as token:
             creds = pickle.load(token)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+    if not creds or (not creds.valid and not (creds.expired and creds.refresh_token)):
+        flow = InstalledAppFlow.from_client_secrets_file('configs/credentials.json', SCOPES)
+        creds = flow.run_local_server(port=0)
+        _save_credentials(creds)
+    return creds
+
+def _needs_refresh(creds):
+    if not creds.refresh_token:
+        return False
+    if creds.expiry is None:
+        return not creds.valid
+    # google-auth keeps expiry as a naive UTC datetime
+    return creds.expiry - datetime.utcnow() < REFRESH_MARGIN
+
+def get_calendar_service():
+    """
+    Returns the cached Calendar service, building it on first use. Credentials are only
+    refreshed when close to expiry and token.pickle is only rewritten when the token changed.
+    The service object is not thread-safe; callers sharing it should serialize requests.
+    """
+    global _creds, _service
+    with _lock:
+        if _creds is None:
+            _creds = _load_credentials()
+        if _needs_refresh(_creds):
+            old_token = _creds.token
+            _creds.refresh(Request())
+            if _creds.token != old_token:
+                _save_credentials(_creds)
+        if _service is None:
+            # use the discovery document bundled with the client library instead of fetching it
+            _service = build('calendar', 'v3', credentials=_creds, cache_discovery=False, static_discovery=True)
+        return _service
+
+
+# background event writer: inserts are queued, coalesced into batch requests and retried with backoff
+BATCH_SIZE = 50
+BATCH_WINDOW = 0.5
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+RETRYABLE_STATUS = (403, 429, 500, 502, 503, 504)
+
+_event_queue = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+
+def insert_event_async(event, callback=None, calendar_id='primary'):
+    """
+    Queues a calendar event insert and returns immediately. callback(created_event, exception)
+    is called from the writer thread once the insert succeeded or finally failed.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_writer_loop, name="calendar_writer", daemon=True)
+            _writer.start()
+    _event_queue.put((calendar_id, event, callback, 0))
+
+def _writer_loop():
+    while True:
+        pending = [_event_queue.get()]
+        # wait briefly for more inserts so bursts go out as one batch
+        deadline = time.monotonic() + BATCH_WINDOW
+        while len(pending) < BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending.append(_event_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        handled = set()
+        try:
+            _insert_batch(pending, handled)
+        except Exception as e:
+            logger.error(f"Calendar batch insert failed: {e}")
+            # only retry inserts whose individual response never came back
+            for i, item in enumerate(pending):
+                if i not in handled:
+                    _retry_or_fail(item, e)
+
+def _insert_batch(pending, handled):
+    service = get_calendar_service()
+
+    def on_response(request_id, response, exception):
+        handled.add(int(request_id))
+        item = pending[int(request_id)]
+        if exception is None:
+            _notify(item[2], response, None)
         else:
-            flow = InstalledAppFlow.from_client_secrets_file('configs/credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
-    service = build('calendar', 'v3', credentials=creds)
-    return service
+            _retry_or_fail(item, exception)
+
+    batch = service.new_batch_http_request(callback=on_response)
+    for i, (calendar_id, event, _, _) in enumerate(pending):
+        batch.add(service.events().insert(calendarId=calendar_id, body=event), request_id=str(i))
+    batch.execute()
+
+def _retry_or_fail(item, exception):
+    calendar_id, event, callback, attempt = item
+    retryable = not isinstance(exception, HttpError) or exception.resp.status in RETRYABLE_STATUS
+    if retryable and attempt < MAX_RETRIES:
+        delay = RETRY_BASE_DELAY * (2 ** attempt)
+        timer = threading.Timer(delay, _event_queue.put, args=[(calendar_id, event, callback, attempt + 1)])
+        timer.daemon = True
+        timer.start()
+    else:
+        _notify(callback, None, exception)
+
+def _notify(callback, response, exception):
+    if callback is None:
+        return
+    try:
+        callback(response, exception)
+    except Exception as e:
+        logger.error(f"Calendar event callback failed: {e}")
@@ -9,11 +9,12 @@ import atexit
 from dotenv import load_dotenv
 
 from langchain_openai import ChatOpenAI
+from langchain_core.callbacks import BaseCallbackHandler
 
 from arklex.utils.utils import init_logger
 from arklex.orchestrator.orchestrator import AgentOrg
 from arklex.orchestrator.generator.generator import Generator
-from arklex.env.tools.RAG.build_rag import build_rag
+from rag_utils import build_rag_incremental
 from arklex.env.tools.database.build_database import build_database
 from arklex.utils.model_config import MODEL
 from arklex.utils.model_provider_config import LLM_PROVIDERS, PROVIDER_MAP
@@ -21,8 +22,29 @@ from arklex.utils.model_provider_config import LLM_PROVIDERS, PROVIDER_MAP
 logger = init_logger(log_level=logging.INFO, filename=os.path.join(os.path.dirname(__file__), "logs", "arklex.log"))
 load_dotenv()
 
+class GeneratorProgress(BaseCallbackHandler):
+    """
+    Reports each LLM call of the task graph generator to a progress callback. Errors raised by the
+    callback (e.g. a cancelled build) are propagated, so they stop the generator at its next step.
+    """
+    raise_error = True
+
+    def __init__(self, progress):
+        self.progress = progress
+        self.steps = 0
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.steps += 1
+        self.progress(f"Generating task graph (step {self.steps})...")
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.on_llm_start(serialized, [], **kwargs)
+
+
 def generate_taskgraph(args):
-    model = PROVIDER_MAP.get(MODEL['llm_provider'], ChatOpenAI)(model=MODEL["model_type_or_path"],timeout=30000)
+    progress = getattr(args, "progress", None)
+    callbacks = [GeneratorProgress(progress)] if progress is not None else None
+    model = PROVIDER_MAP.get(MODEL['llm_provider'], ChatOpenAI)(model=MODEL["model_type_or_path"],timeout=30000,callbacks=callbacks)
     generator = Generator(args, args.config, model, args.output_dir)
     taskgraph_filepath = generator.generate()
     # Update the task graph with the API URLs
@@ -40,7 +62,9 @@ def init_worker(args):
     worker_names = set([worker["name"] for worker in workers])
     if "FaissRAGWorker" in worker_names:
         logger.info("Initializing FaissRAGWorker...")
-        build_rag(args.output_dir, config["rag_docs"])
+        # reuses crawled documents and chunks from the agent in --base-dir, if any
+        build_rag_incremental(args.output_dir, config["rag_docs"], getattr(args, "base_dir", None),
+                              progress=getattr(args, "progress", None))
 
     elif any(node in worker_names for node in ("DataBaseWorker", "search_show", "book_show", "check_booking", "cancel_booking")):
         logger.info("Initializing DataBaseWorker...")
@@ -51,6 +75,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--config', type=str, default="./arklex/orchestrator/examples/customer_service_config.json")
     parser.add_argument('--output-dir', type=str, default="./examples/test")
+    parser.add_argument('--base-dir', type=str, default=None, help="existing agent directory to reuse RAG documents from")
     parser.add_argument('--model', type=str, default=MODEL["model_type_or_path"])
     parser.add_argument( '--llm-provider',type=str,default=MODEL["llm_provider"],choices=LLM_PROVIDERS)
     parser.add_argument('--log-level', type=str, default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"])
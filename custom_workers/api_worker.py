@@ -1,9 +1,20 @@
 import logging
 import json
+import atexit
 import requests
 import os
+import re
+import time
+import hashlib
+import threading
+import uuid
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from langgraph.graph import StateGraph, START
-from langchain_openai import ChatOpenAI
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
@@ -16,6 +27,414 @@ logger = logging.getLogger(__name__)
 api_keys = {
     "ALPHA_VANTAGE_KEY": "empty"
 }
+# HTTP client settings, overridable through the environment
+REQUEST_CONNECT_TIMEOUT = float(os.environ.get("REQUEST_CONNECT_TIMEOUT", 3.05))
+REQUEST_READ_TIMEOUT = float(os.environ.get("REQUEST_READ_TIMEOUT", 30))
+REQUEST_MAX_RETRIES = int(os.environ.get("REQUEST_MAX_RETRIES", 3))
+REQUEST_BACKOFF_FACTOR = float(os.environ.get("REQUEST_BACKOFF_FACTOR", 0.5))
+REQUEST_POOL_CONNECTIONS = int(os.environ.get("REQUEST_POOL_CONNECTIONS", 10))
+REQUEST_POOL_MAXSIZE = int(os.environ.get("REQUEST_POOL_MAXSIZE", 10))
+REQUEST_MAX_CONCURRENCY = int(os.environ.get("REQUEST_MAX_CONCURRENCY", 8))
+# response bodies are read up to RESPONSE_MAX_BYTES and trimmed to roughly RESPONSE_TOKEN_BUDGET tokens
+RESPONSE_MAX_BYTES = int(os.environ.get("RESPONSE_MAX_BYTES", 4 * 1024 * 1024))
+RESPONSE_TOKEN_BUDGET = int(os.environ.get("RESPONSE_TOKEN_BUDGET", 2000))
+CHARS_PER_TOKEN = 4
+
+# response cache settings; TTLs (seconds) are matched against the call URL, first match wins
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 256))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+RESPONSE_CACHE_DEFAULT_TTL = float(os.environ.get("RESPONSE_CACHE_DEFAULT_TTL", 300))
+endpoint_ttls = {
+    "function=GLOBAL_QUOTE": 60,
+    "function=TIME_SERIES_INTRADAY": 60,
+    "function=CURRENCY_EXCHANGE_RATE": 60,
+    "function=TIME_SERIES_DAILY": 3600,
+    "function=TIME_SERIES_WEEKLY": 6 * 3600,
+    "function=TIME_SERIES_MONTHLY": 6 * 3600,
+    "function=OVERVIEW": 24 * 3600,
+    "function=SYMBOL_SEARCH": 24 * 3600
+}
+
+# Alpha Vantage answers errors and throttling with HTTP 200 and one of these keys in the body
+API_ERROR_KEYS = ("Error Message", "Note", "Information")
+
+
+def api_error(body):
+    """
+    Returns the error message of a 200 response that is really an API error, or None.
+    """
+    try:
+        data = json.loads(body)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(data, dict):
+        for key in API_ERROR_KEYS:
+            if key in data:
+                return f"{key}: {data[key]}"
+    return None
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU cache of API responses with per-entry TTLs, bounded by entry count and total body size.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ttl_for(self, key):
+        for pattern, ttl in endpoint_ttls.items():
+            if pattern in key:
+                return ttl
+        return RESPONSE_CACHE_DEFAULT_TTL
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, size, value = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size):
+        ttl = self.ttl_for(key)
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, size, value)
+            self._size += size
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self._size}
+
+
+# shared across RequestWorker instances so every Env rebuild keeps the warm cache
+response_cache = ResponseCache()
+
+# call string cache settings; a threshold of 1 or more disables the embedding tier
+CALL_CACHE_PATH = os.environ.get("CALL_CACHE_PATH", "./agent/call_cache.json")
+CALL_CACHE_MAX_ENTRIES = int(os.environ.get("CALL_CACHE_MAX_ENTRIES", 500))
+CALL_CACHE_SIMILARITY = float(os.environ.get("CALL_CACHE_SIMILARITY", 0.97))
+# changes are written to disk in the background at most once per CALL_CACHE_SAVE_DELAY seconds
+CALL_CACHE_SAVE_DELAY = float(os.environ.get("CALL_CACHE_SAVE_DELAY", 5))
+# filler words that may differ between two requests served by the same call
+CALL_CACHE_STOPWORDS = frozenset("""
+a an the of for on in at to and or is are was what what's whats s me my i we us you your can could
+would please show tell give get find look up check current currently latest today now how much
+""".split())
+# words that make a request depend on earlier turns, e.g. "and the weekly one?"
+CALL_CACHE_REFERENTIAL = frozenset("""
+it its this that these those them they one ones same again other another instead too also
+""".split())
+# the embedding tier only considers cached requests that differ in at most this many words
+CALL_CACHE_MAX_REPHRASED = 2
+
+
+class CallStringCache:
+    """
+    Disk-persisted cache mapping user requests to previously generated API call strings.
+    Entries are scoped to the context the call was generated in (other workers' output, plus the
+    conversation for referential requests like "and the weekly one?"), so a follow-up never
+    replays another call while "price of IBM" hits for the rest of the session.
+    Lookups try an exact match on the normalized request first, then a request with the same
+    non-filler words (reordered or reworded filler), and only then the most similar rephrasing
+    by embedding cosine similarity. Rephrasings must keep every word the cached call uses, so
+    "price of ibm" never resolves to the cached "price of msft" call.
+    Entries are kept in a JSON file and their embeddings in a .npy file next to it; embeddings
+    and writes are batched and happen in the background.
+    """
+
+    def __init__(self, path=CALL_CACHE_PATH, max_entries=CALL_CACHE_MAX_ENTRIES, threshold=CALL_CACHE_SIMILARITY):
+        self.path = path
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._embeddings = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._save_timer = None
+        self._embeddings_file = None
+        self._load()
+        atexit.register(self.flush)
+
+    @staticmethod
+    def normalize(text):
+        text = re.sub(r"[^\w\s]", " ", text.lower())
+        return " ".join(text.split())
+
+    @classmethod
+    def entities(cls, text):
+        # every word that is not filler, e.g. tickers, currency codes, dates, endpoint names
+        return sorted(set(cls.normalize(text).split()) - CALL_CACHE_STOPWORDS)
+
+    @classmethod
+    def is_referential(cls, text):
+        words = set(cls.normalize(text).split())
+        return not (words - CALL_CACHE_STOPWORDS) or bool(words & CALL_CACHE_REFERENTIAL)
+
+    @staticmethod
+    def context_key(context):
+        return hashlib.sha256(context.strip().encode("utf-8")).hexdigest() if context and context.strip() else ""
+
+    def key_for(self, text, context=""):
+        return hashlib.sha256(f"{self.context_key(context)}\n{self.normalize(text)}".encode("utf-8")).hexdigest()
+
+    def _embed(self, texts):
+        if self.threshold >= 1 or not texts:
+            return None
+        try:
+            if self._embeddings is None:
+                self._embeddings = OpenAIEmbeddings()
+            vectors = np.asarray(self._embeddings.embed_documents(texts), dtype=np.float32)
+            return vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+        except Exception as e:
+            logger.warning(f"Call cache embedding failed, using exact matches only: {e}")
+            return None
+
+    def _hit(self, key, semantic=False):
+        # called with the lock held
+        self._entries.move_to_end(key)
+        if semantic:
+            self.semantic_hits += 1
+        else:
+            self.hits += 1
+        return self._entries[key]["call_string"]
+
+    def get(self, text, context=""):
+        key = self.key_for(text, context)
+        context_key = self.context_key(context)
+        entities = self.entities(text)
+        with self._lock:
+            if key in self._entries:
+                return self._hit(key)
+            candidates = []
+            for k, e in self._entries.items():
+                if e["context"] != context_key:
+                    continue
+                if e["entities"] == entities:
+                    return self._hit(k)
+                if (e.get("embedding") is not None
+                        and len(set(e["entities"]) ^ set(entities)) <= CALL_CACHE_MAX_REPHRASED
+                        and set(e["params"]) <= set(entities)):
+                    candidates.append((k, e))
+            if not candidates:
+                self.misses += 1
+                return None
+
+        # only reached when a cached rephrasing is plausible, so most lookups cost no embedding call
+        vectors = self._embed([self.normalize(text)])
+        if vectors is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        matrix = np.stack([e["embedding"] for _, e in candidates])
+        scores = matrix @ vectors[0]
+        best = int(np.argmax(scores))
+        with self._lock:
+            best_key = candidates[best][0]
+            if scores[best] < self.threshold or best_key not in self._entries:
+                self.misses += 1
+                return None
+            return self._hit(best_key, semantic=True)
+
+    def put(self, text, call_string, context=""):
+        entities = self.entities(text)
+        call_words = set(self.normalize(call_string).split())
+        entry = {
+            "call_string": call_string,
+            "request": self.normalize(text),
+            "entities": entities,
+            # the request words the call uses (e.g. the ticker); a rephrasing has to keep them
+            "params": [word for word in entities if word in call_words],
+            "context": self.context_key(context),
+            # computed by the background writer, off the request path
+            "embedding": None
+        }
+        with self._lock:
+            key = self.key_for(text, context)
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._schedule_save()
+
+    def discard(self, call_string):
+        """
+        Drops every entry that maps to call_string, e.g. after replaying it failed.
+        """
+        with self._lock:
+            stale = [k for k, e in self._entries.items() if e["call_string"] == call_string]
+            for key in stale:
+                del self._entries[key]
+            if stale:
+                self._schedule_save()
+
+    def _schedule_save(self):
+        # called with the lock held; coalesces bursts of puts into one write off the request path
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(CALL_CACHE_SAVE_DELAY, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as file:
+                data = json.load(file)
+            if "entries" not in data:
+                # caches written before entries were scoped to their context are dropped
+                logger.info(f"Ignoring call cache in an old format at {self.path}")
+                return
+            matrix = None
+            if data.get("embeddings"):
+                matrix = np.load(os.path.join(os.path.dirname(self.path), data["embeddings"]))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load call cache from {self.path}: {e}")
+            return
+        self._embeddings_file = data.get("embeddings")
+        for key, entry in data["entries"].items():
+            if "params" not in entry:
+                # scoped to the whole conversation, such entries can never hit again
+                continue
+            row = entry.pop("row", None)
+            entry["embedding"] = matrix[row] if row is not None and matrix is not None else None
+            self._entries[key] = entry
+
+    def flush(self):
+        """
+        Embeds new entries and writes the cache to disk, off the request path (from the save
+        timer, and at exit). Embeddings go to a new .npy file first and
+        the JSON that names it is swapped in afterwards, so a crash never pairs entries with the
+        wrong embeddings or leaves a truncated cache.
+        """
+        with self._lock:
+            pending = [(k, e["request"]) for k, e in self._entries.items() if e.get("embedding") is None]
+        if pending:
+            vectors = self._embed([request for _, request in pending])
+            if vectors is not None:
+                with self._lock:
+                    for (key, _), vector in zip(pending, vectors):
+                        if key in self._entries:
+                            self._entries[key]["embedding"] = vector
+        with self._lock:
+            self._save_timer = None
+            entries = {}
+            vectors = []
+            for key, entry in self._entries.items():
+                record = {k: v for k, v in entry.items() if k != "embedding"}
+                if entry.get("embedding") is not None:
+                    record["row"] = len(vectors)
+                    vectors.append(entry["embedding"])
+                entries[key] = record
+        try:
+            self._write(entries, vectors)
+        except OSError as e:
+            logger.warning(f"Could not persist call cache to {self.path}: {e}")
+
+    def _write(self, entries, vectors):
+        with self._write_lock:
+            directory = os.path.dirname(self.path) or "."
+            os.makedirs(directory, exist_ok=True)
+            embeddings_file = None
+            if vectors:
+                stem = os.path.splitext(os.path.basename(self.path))[0]
+                embeddings_file = f"{stem}.{uuid.uuid4().hex[:12]}.npy"
+                np.save(os.path.join(directory, embeddings_file), np.stack(vectors))
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as file:
+                json.dump({"embeddings": embeddings_file, "entries": entries}, file)
+            os.replace(tmp_path, self.path)
+            if self._embeddings_file and self._embeddings_file != embeddings_file:
+                try:
+                    os.remove(os.path.join(directory, self._embeddings_file))
+                except OSError:
+                    pass
+            self._embeddings_file = embeddings_file
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "semantic_hits": self.semantic_hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+call_cache = CallStringCache()
+
+
+def _trim_json(value, limit, max_str=500):
+    if isinstance(value, dict):
+        items = list(value.items())
+        trimmed = {key: _trim_json(item, limit, max_str) for key, item in items[:limit]}
+        if len(items) > limit:
+            trimmed["..."] = f"{len(items) - limit} more entries omitted"
+        return trimmed
+    if isinstance(value, list):
+        trimmed = [_trim_json(item, limit, max_str) for item in value[:limit]]
+        if len(value) > limit:
+            trimmed.append(f"... {len(value) - limit} more items omitted")
+        return trimmed
+    if isinstance(value, str) and len(value) > max_str:
+        return value[:max_str] + "..."
+    return value
+
+
+def compact_body(text, max_chars):
+    """
+    Shrinks an API response body to at most max_chars. JSON bodies keep their structure and
+    are trimmed to the first entries of every large object/array (e.g. the most recent days of
+    a time series); anything else is cut off with a marker.
+    """
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+    if data is not None:
+        compact = json.dumps(data, separators=(",", ":"))
+        for limit in (100, 50, 20, 10, 5, 2):
+            if len(compact) <= max_chars:
+                return compact
+            compact = json.dumps(_trim_json(data, limit), separators=(",", ":"))
+        text = compact
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + "...[truncated]"
+
+formatter_template = """
+
+{user_message}
+{rag_context}
+{formatting_context}
+"""
+
 formatting_context = """
 To format a response, use the following encode, and include nothing more in the response. Your output will be parsed appropriately. 
 
@@ -23,20 +442,93 @@ To format a response, use the following encode, and include nothing more in the
 	“url”: [insert here full API call URL. replace any authkey requirements with the AuthKeyName],
 	“AuthKeyName”: [insert here name of AuthKey e.g. ALPHA_VANTAGE_KEY]
 }
+
+If the request needs several API calls (e.g. quotes for multiple tickers), return a JSON list of objects in the format above, one per call.
 """
+
+
+def _create_session() -> requests.Session:
+    # keep-alive session with bounded per-host pools and retry/backoff on 429 and 5xx
+    retry = Retry(
+        total=REQUEST_MAX_RETRIES,
+        backoff_factor=REQUEST_BACKOFF_FACTOR,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=REQUEST_POOL_CONNECTIONS,
+        pool_maxsize=REQUEST_POOL_MAXSIZE,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+
+def parse_call_specs(call_string):
+    """
+    Parses the formatter's answer into a list of call specs, raising ValueError unless it is a
+    call object or a non-empty list of them, each with a URL and a known AuthKeyName.
+    """
+    calls = json.loads(call_string)
+    if isinstance(calls, dict):
+        calls = [calls]
+    if not isinstance(calls, list) or not calls:
+        raise ValueError("expected a call object or a non-empty list of call objects")
+    for call in calls:
+        if not isinstance(call, dict) or not isinstance(call.get("url"), str):
+            raise ValueError(f"call spec without a url: {call!r}")
+        if call.get("AuthKeyName") not in api_keys:
+            raise ValueError(f"unknown AuthKeyName: {call.get('AuthKeyName')!r}")
+    return calls
+
+# shared by every RequestWorker instance, like response_cache
+session = _create_session()
+request_executor = ThreadPoolExecutor(max_workers=REQUEST_MAX_CONCURRENCY, thread_name_prefix="request_worker")
+formatter_prompt = PromptTemplate.from_template(formatter_template)
+_format_chains = {}
+_format_chain_lock = threading.Lock()
+
+
+def get_format_chain():
+    """
+    Returns the call formatting chain for the currently selected model, built once per
+    provider/model and reused across workers.
+    """
+    key = (MODEL["llm_provider"], MODEL["model_type_or_path"])
+    with _format_chain_lock:
+        if key not in _format_chains:
+            llm = PROVIDER_MAP.get(key[0], ChatOpenAI)(model=key[1], timeout=30000)
+            _format_chains[key] = llm | StrOutputParser()
+        return _format_chains[key]
+
+
 @register_worker
 class RequestWorker(BaseWorker):
     description = "Processes information from the user (and other workers where appropriate) to generate a valid API payload which is sent to a relevant endpoint." \
     "The worker will return to the state information on the response from the API for use to contribute to address the user's goal." \
     "IMPORTANT: If the user ever asks a question related to making an API request, this worker should be used"
 
+    # arklex's Env builds a new worker on every step, so the compiled graph is shared by all instances
+    _graph = None
+    _graph_lock = threading.Lock()
+
     def __init__(self):
         super().__init__()
-        self.action_graph = self._create_action_graph()
-        self.llm = PROVIDER_MAP.get(MODEL['llm_provider'], ChatOpenAI)(
-            model = MODEL["model_type_or_path"], timeout=30000
-        )
-        
+        self.graph = self._compiled_graph(self)
+
+    @classmethod
+    def _compiled_graph(cls, worker):
+        # the nodes only use module-level state, so binding them to the first instance is safe
+        with cls._graph_lock:
+            if cls._graph is None:
+                cls._graph = worker._create_action_graph().compile()
+            return cls._graph
+
     def req_str_to_dict(self, req_str: str, delimiter="<") -> dict:
         elements_list = req_str.split(delimiter)
         req_elements = {
@@ -50,49 +542,131 @@ class RequestWorker(BaseWorker):
     def format_user_message(self, state: MessageState) -> MessageState:
         user_message = state["user_message"]
 
+        # repeated requests reuse the call string generated for them before and skip the LLM
+        request_text = str(getattr(user_message, "message", user_message))
+        # the same words can need a different call depending on other workers' output, and for
+        # referential requests ("and the weekly one?") on the conversation so far
+        call_context = state.get("message_flow", "")
+        if call_cache.is_referential(request_text):
+            call_context = f"{call_context}\n{getattr(user_message, 'history', '')}"
+        state["metadata"]["call_request_text"] = request_text
+        state["metadata"]["call_context"] = call_context
+        cached_call = call_cache.get(request_text, call_context)
+        if cached_call is not None:
+            logger.info("Using cached API call string")
+            state["metadata"]["call_string"] = cached_call
+            state["metadata"]["call_string_cached"] = True
+            return state
+        state["metadata"]["call_string_cached"] = False
+
         rag_context = state.get("message_flow", "")
         if rag_context:
             rag_context = f"Here is context from other workers that are working to help the user: {rag_context}"
         #else:
         #    alt_context = "N/A"
 
-        formatter_template = """
-
-        {user_message}
-        {rag_context}
-        {formatting_context}
-        """
-        
-
-
-        formatter_prompt = PromptTemplate.from_template(formatter_template)
-
         input_prompt = formatter_prompt.invoke({
             "user_message": user_message,
-            "alt_context": rag_context,
-            "API_CONTEXT": formatting_context
+            "rag_context": rag_context,
+            "formatting_context": formatting_context
         })
         
-        final_chain = self.llm | StrOutputParser()
         prompt_string = input_prompt.text
         print(f"Format Prompt: {prompt_string}")
-        formatted_api_string = final_chain.invoke(prompt_string).strip()
+        formatted_api_string = get_format_chain().invoke(prompt_string).strip()
         
         print(f"{formatted_api_string}")
         state["metadata"]["call_string"] = formatted_api_string
 
         return state
 
-    def gen_request(self, state: MessageState) -> MessageState: #
-        call_string = state["metadata"]["call_string"]
-        request = json.loads(call_string)
+    def _read_body(self, response: requests.Response) -> tuple[str, bool, int]:
+        # stream the body and stop at RESPONSE_MAX_BYTES instead of buffering arbitrarily large payloads;
+        # also returns how many bytes were actually read
+        chunks = []
+        size = 0
+        truncated = False
+        try:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= RESPONSE_MAX_BYTES:
+                    truncated = True
+                    break
+        finally:
+            response.close()
+        body = b"".join(chunks)[:RESPONSE_MAX_BYTES]
+        return body.decode(response.encoding or "utf-8", errors="replace"), truncated, size
+
+    def _fetch(self, request: dict) -> dict:
         url_call = request["url"]
         auth_key = api_keys[request["AuthKeyName"]]
         full_call = url_call.replace(request["AuthKeyName"], auth_key)
-        print(full_call)
-        api_response = requests.get(full_call)
-        state["metadata"]["api_response"] = api_response
-        print(api_response)
+        print(url_call)
+        start = time.perf_counter()
+        # the cache key is the URL before auth substitution, so secrets never end up in it
+        result = response_cache.get(url_call)
+        if result is not None:
+            result = dict(result, cache="hit")
+        else:
+            result = {"url": url_call, "ok": False, "status": None, "body": None, "error": None, "cache": "miss"}
+            try:
+                api_response = session.get(
+                    full_call, timeout=(REQUEST_CONNECT_TIMEOUT, REQUEST_READ_TIMEOUT), stream=True
+                )
+                text, truncated, raw_bytes = self._read_body(api_response)
+                result["ok"] = api_response.ok
+                result["status"] = api_response.status_code
+                result["raw_bytes"] = raw_bytes
+                result["body_truncated"] = truncated
+                if api_response.ok:
+                    result["body"] = compact_body(text, RESPONSE_TOKEN_BUDGET * CHARS_PER_TOKEN)
+                    result["error"] = api_error(result["body"])
+                    if result["error"]:
+                        # error and rate-limit notices must not be cached for the endpoint TTL
+                        result["ok"] = False
+                    else:
+                        response_cache.put(url_call, dict(result), len(result["body"]))
+                else:
+                    result["error"] = f"{api_response.status_code} {api_response.reason}"
+            except requests.exceptions.RequestException as e:
+                logger.error(f"API request to {url_call} failed: {e}")
+                result["error"] = str(e)
+        result["latency_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        print(f"{result['status']} ({result['cache']}, {result['latency_ms']} ms)")
+        return result
+
+    def gen_request(self, state: MessageState) -> MessageState: #
+        call_string = state["metadata"]["call_string"]
+        start = time.perf_counter()
+        try:
+            calls = parse_call_specs(call_string)
+        except ValueError as e:
+            logger.error(f"Invalid API call string {call_string!r}: {e}")
+            calls = []
+            results = [{"url": None, "ok": False, "status": None, "body": None,
+                        "error": f"invalid API call: {e}", "cache": "none", "latency_ms": 0.0}]
+        if len(calls) == 1:
+            results = [self._fetch(calls[0])]
+        elif calls:
+            # fan out over the pooled session, capped at REQUEST_MAX_CONCURRENCY in flight
+            results = list(request_executor.map(self._fetch, calls))
+        state["metadata"]["api_latency_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        state["metadata"]["api_results"] = results
+        # "hit"/"miss" when every call agrees, "partial" for a mix
+        cache_states = set(result["cache"] for result in results)
+        state["metadata"]["api_cache"] = cache_states.pop() if len(cache_states) == 1 else "partial"
+        errors = [result["error"] for result in results if result["error"]]
+        if errors:
+            state["metadata"]["api_error"] = "; ".join(errors)
+
+        # only call strings that produced working requests are worth remembering, and a cached
+        # one that fails (e.g. the API changed) is forgotten so the next request regenerates it
+        if state["metadata"].get("call_string_cached"):
+            if not all(result["ok"] for result in results):
+                call_cache.discard(call_string)
+        elif all(result["ok"] for result in results):
+            call_cache.put(state["metadata"]["call_request_text"], call_string, state["metadata"]["call_context"])
         return state
         #request = self.req_str_to_dict(call_string)
         #print(f"Request: {request}")
@@ -122,15 +696,20 @@ class RequestWorker(BaseWorker):
         #        state["metadata"]["api_response"] = "API request could not be made"
         #        return state
     
+    def _response_text(self, result: dict) -> str:
+        if not result["ok"]:
+            return f"API Request Failed: {result['error']}"
+        logger.info(f"API Response ({len(result['body'])} chars): {result['body'][:500]}")
+        return result["body"]
+
     def handle_response(self, state: MessageState) -> MessageState:
-        
-        response = state["metadata"]["api_response"]
-        logger.info(f"API Response: {response.text}")
-        try:
-            response.raise_for_status()
-            state["response"] = response.text
-        except requests.exceptions.HTTPError as e:
-             state["response"] = f"API Request Failed: {e}"
+        results = state["metadata"]["api_results"]
+        if len(results) == 1:
+            state["response"] = self._response_text(results[0])
+        else:
+            state["response"] = "\n\n".join(
+                f"Response from {result['url']}:\n{self._response_text(result)}" for result in results
+            )
 
         return state
     
@@ -146,8 +725,7 @@ class RequestWorker(BaseWorker):
         return workflow
 
     def execute(self, msg_state: MessageState):
-        graph = self.action_graph.compile()
-        result = graph.invoke(msg_state)
+        result = self.graph.invoke(msg_state)
         return result
 
     
@@ -0,0 +1,106 @@
+import os
+import pickle
+import logging
+import threading
+from collections import OrderedDict
+
+from langchain_community.vectorstores.faiss import FAISS
+
+from arklex.env.tools.RAG.retrievers.faiss_retriever import FaissRetrieverExecutor
+from arklex.utils.model_config import MODEL
+
+from rag_utils import ChunkStore, CHUNKS_STORE, embed_texts, embedding_model, record_to_chunk, store_version
+
+logger = logging.getLogger(__name__)
+
+# arklex calls FaissRetrieverExecutor.load_docs on every retrieval, which re-reads and re-embeds
+# all chunks; executors are kept per (agent dir, store version, model), most recently used last
+RETRIEVER_CACHE_SIZE = 4
+_retrievers = OrderedDict()
+_retrievers_lock = threading.Lock()
+
+
+class StoredVectorRetriever(FaissRetrieverExecutor):
+    """
+    FaissRetrieverExecutor whose index is built from the embeddings stored with the agent's
+    chunks instead of embedding every chunk again. Chunks without stored embeddings (e.g. of
+    agents built before they were stored) are embedded once and stored for next time.
+    """
+
+    def __init__(self, store, texts, **kwargs):
+        self.store = store
+        # newer arklex versions pick the embedding model from the llm_config they pass
+        llm_config = kwargs.get("llm_config")
+        self.provider = llm_config.llm_provider if llm_config is not None else MODEL["llm_provider"]
+        super().__init__(texts=texts, **kwargs)
+
+    def _init_retriever(self, **kwargs):
+        model_name, embeddings = embedding_model(self.provider)
+        vectors = self.store.vectors(model_name, lambda texts: embed_texts(embeddings, texts))
+        docsearch = FAISS.from_embeddings(
+            [(doc.page_content, vector) for doc, vector in zip(self.texts, vectors)],
+            embeddings,
+            metadatas=[doc.metadata for doc in self.texts]
+        )
+        return docsearch.as_retriever(**kwargs)
+
+
+def load_chunks(database_path):
+    """
+    Returns an agent's chunk Documents, read from its memory-mapped chunk store, or from
+    chunked_documents.pkl for agents built before the store existed. Every chunk is decoded
+    into a Document up front, since the FAISS index needs all of them; what the store saves is
+    unpickling, not per-chunk reads at retrieval time.
+    """
+    if ChunkStore.exists(database_path, CHUNKS_STORE):
+        return [record_to_chunk(record) for record in ChunkStore(database_path, CHUNKS_STORE)]
+    with open(os.path.join(database_path, "chunked_documents.pkl"), "rb") as file:
+        return pickle.load(file)
+
+
+def _chunks_version(database_path):
+    version = store_version(database_path, CHUNKS_STORE)
+    if version is not None:
+        return version
+    return os.stat(os.path.join(database_path, "chunked_documents.pkl")).st_mtime_ns
+
+
+def load_docs(database_path, **kwargs):
+    """
+    Drop-in replacement for FaissRetrieverExecutor.load_docs. Extra keyword arguments (e.g. the
+    llm_config newer arklex versions pass) are forwarded to the executor.
+    """
+    # accepted by some arklex versions but never used
+    kwargs.pop("embeddings", None)
+    kwargs.pop("index_path", None)
+    key = (
+        os.path.abspath(database_path),
+        _chunks_version(database_path),
+        MODEL["llm_provider"],
+        MODEL["model_type_or_path"],
+        repr(sorted(kwargs.items()))
+    )
+    with _retrievers_lock:
+        retriever = _retrievers.get(key)
+        if retriever is not None:
+            _retrievers.move_to_end(key)
+            return retriever
+
+    documents = load_chunks(database_path)
+    logger.info(f"Loaded {len(documents)} chunks from {database_path}")
+    index_path = os.path.join(database_path, "index")
+    if ChunkStore.exists(database_path, CHUNKS_STORE):
+        store = ChunkStore(database_path, CHUNKS_STORE)
+        retriever = StoredVectorRetriever(store, texts=documents, index_path=index_path, **kwargs)
+    else:
+        retriever = FaissRetrieverExecutor(texts=documents, index_path=index_path, **kwargs)
+    with _retrievers_lock:
+        _retrievers[key] = retriever
+        while len(_retrievers) > RETRIEVER_CACHE_SIZE:
+            _retrievers.popitem(last=False)
+    return retriever
+
+
+def install_store_loader():
+    # FaissRAGWorker reaches the chunks only through this static method
+    FaissRetrieverExecutor.load_docs = staticmethod(load_docs)
@@ -1,17 +1,349 @@
 import logging
+import os
+import time
+import socket
+import atexit
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
+from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED, EVENT_JOB_REMOVED, EVENT_ALL_JOBS_REMOVED, EVENT_JOB_SUBMITTED
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.triggers.date import DateTrigger
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import create_engine, MetaData, Table, Column, String, Float, select, delete, update
+from sqlalchemy.exc import IntegrityError
 
 from arklex.env.workers.worker import BaseWorker, register_worker
 from arklex.utils.graph_state import MessageState
 from arklex.env.workers.message_worker import MessageWorker
 
-from calendar_utils import get_calendar_service # Utility module import
+from calendar_utils import insert_event_async # Utility module import
 
 logger = logging.getLogger(__name__)
 
+# job store and coordination settings, overridable through the environment
+SCHEDULER_DB_URL = os.environ.get("SCHEDULER_DB_URL", "sqlite:///scheduler_jobs.sqlite")
+SCHEDULER_POLL_SECONDS = int(os.environ.get("SCHEDULER_POLL_SECONDS", 30))
+# the leader holds a lease in the job store database and renews it every third of this, so a
+# replica that dies or loses the database is replaced within SCHEDULER_LEASE_SECONDS
+SCHEDULER_LEASE_SECONDS = int(os.environ.get("SCHEDULER_LEASE_SECONDS", 90))
+# seconds a missed run may be late and still fire; unset means no limit, so reminders that came
+# due while the app was down still fire (once, thanks to coalesce) after a restart
+SCHEDULER_MISFIRE_GRACE = int(os.environ["SCHEDULER_MISFIRE_GRACE"]) if os.environ.get("SCHEDULER_MISFIRE_GRACE") else None
+# task execution pool: worker threads, max queued tasks, per-user rate (tasks/minute) and burst
+SCHEDULER_MAX_WORKERS = int(os.environ.get("SCHEDULER_MAX_WORKERS", 32))
+SCHEDULER_MAX_QUEUE = int(os.environ.get("SCHEDULER_MAX_QUEUE", 2000))
+SCHEDULER_USER_RATE = float(os.environ.get("SCHEDULER_USER_RATE", 30))
+SCHEDULER_USER_BURST = int(os.environ.get("SCHEDULER_USER_BURST", 5))
+
+# one scheduler per process, shared by every SchedulerWorker instance
+_scheduler = None
+_scheduler_lock = threading.Lock()
+# identifies this process as the owner of the leader lease
+_instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# fired jobs run on a shared pool, each pool thread keeps its own MessageWorker
+_task_pool = ThreadPoolExecutor(max_workers=SCHEDULER_MAX_WORKERS, thread_name_prefix="scheduled_task")
+_task_slots = threading.BoundedSemaphore(SCHEDULER_MAX_QUEUE)
+_thread_state = threading.local()
+_rate_buckets = {}
+_rate_lock = threading.Lock()
+_metrics = {
+    "queue_depth": 0,
+    "running": 0,
+    "completed": 0,
+    "failed": 0,
+    "rate_limited": 0,
+    "last_job_lag": 0.0,
+    "max_job_lag": 0.0,
+    "last_queue_wait": 0.0,
+    "max_queue_wait": 0.0
+}
+_metrics_lock = threading.Lock()
+
+# secondary index of scheduled jobs by user, stored next to the job store so every replica sees
+# the same index; kept in sync through scheduler events
+_index_engine = None
+_index_metadata = MetaData()
+_user_jobs_table = Table(
+    "scheduler_user_jobs", _index_metadata,
+    Column("job_id", String(191), primary_key=True),
+    Column("user_id", String(191), nullable=False, index=True)
+)
+# single-row lease table: the replica named in owner runs jobs until expires_at
+_leader_table = Table(
+    "scheduler_leader", _index_metadata,
+    Column("name", String(64), primary_key=True),
+    Column("owner", String(191), nullable=False),
+    Column("expires_at", Float, nullable=False)
+)
+
+
+def _job_listener(event):
+    if event.code == EVENT_JOB_MISSED:
+        logger.warning(f"Job {event.job_id} missed its run time and was skipped.")
+    elif event.exception:
+        logger.error(f"Job {event.job_id} failed!")
+    else:
+        logger.info(f"Job {event.job_id} executed successfully.")
+
+
+def _calendar_listener(job_id):
+    # reports the outcome of the background calendar insert for a scheduled job
+    def listener(created_event, exception):
+        if exception is not None:
+            logger.error(f"Failed to create Google Calendar event for job {job_id}: {exception}")
+        else:
+            logger.info(f"Created Google Calendar event for job {job_id}: {created_event.get('htmlLink')}")
+    return listener
+
+
+def _lag_listener(event):
+    # time between a job's scheduled run time and the scheduler handing it to the executor
+    if event.job_id == "job_store_poll" or not event.scheduled_run_times:
+        return
+    lag = (datetime.now(timezone.utc) - min(event.scheduled_run_times)).total_seconds()
+    with _metrics_lock:
+        _metrics["last_job_lag"] = lag
+        _metrics["max_job_lag"] = max(_metrics["max_job_lag"], lag)
+
+
+def get_task_metrics():
+    """
+    Snapshot of the scheduled task pool: queue depth, running tasks, totals and lag in seconds.
+    """
+    with _metrics_lock:
+        return dict(_metrics)
+
+
+def _index_job(user_id, job_id):
+    with _index_engine.begin() as connection:
+        connection.execute(delete(_user_jobs_table).where(_user_jobs_table.c.job_id == job_id))
+        connection.execute(_user_jobs_table.insert().values(job_id=job_id, user_id=str(user_id)))
+
+
+def _unindex_job(job_id):
+    with _index_engine.begin() as connection:
+        connection.execute(delete(_user_jobs_table).where(_user_jobs_table.c.job_id == job_id))
+
+
+def _indexed_jobs(user_id):
+    with _index_engine.connect() as connection:
+        rows = connection.execute(
+            select(_user_jobs_table.c.job_id).where(_user_jobs_table.c.user_id == str(user_id))
+        )
+        return [row.job_id for row in rows]
+
+
+def _backfill_index(scheduler):
+    # indexes stored jobs that have no row yet, e.g. jobs written before the index existed
+    with _index_engine.connect() as connection:
+        indexed = set(row.job_id for row in connection.execute(select(_user_jobs_table.c.job_id)))
+    for job in scheduler.get_jobs(jobstore="default"):
+        if job.func is run_user_task and job.args and job.id not in indexed:
+            _index_job(job.args[0], job.id)
+
+
+def _index_listener(event):
+    # one-off jobs are removed by the scheduler after they fire, drop them from the index too
+    try:
+        if event.code == EVENT_ALL_JOBS_REMOVED:
+            if event.alias != "local":
+                with _index_engine.begin() as connection:
+                    connection.execute(delete(_user_jobs_table))
+        else:
+            _unindex_job(event.job_id)
+    except Exception as e:
+        # a stale row is harmless, lookups drop ids whose job is gone
+        logger.warning(f"Could not update the user job index: {e}")
+
+
+def _poll_job_store():
+    # no-op; running it wakes the scheduler so jobs added by other processes are picked up
+    pass
+
+
+def _try_acquire_leadership():
+    """
+    Takes or renews the leader lease in the shared job store database. Only the lease holder
+    fires jobs, so replicas on any number of hosts sharing SCHEDULER_DB_URL never double-fire
+    a reminder. The update is a single conditional statement, so it is atomic on every backend.
+    """
+    now = time.time()
+    expires_at = now + SCHEDULER_LEASE_SECONDS
+    try:
+        with _index_engine.begin() as connection:
+            renewed = connection.execute(
+                update(_leader_table)
+                .where(_leader_table.c.name == "scheduler")
+                .where((_leader_table.c.owner == _instance_id) | (_leader_table.c.expires_at < now))
+                .values(owner=_instance_id, expires_at=expires_at)
+            ).rowcount
+            if renewed:
+                return True
+            if connection.execute(select(_leader_table.c.name)).first() is not None:
+                return False
+            connection.execute(_leader_table.insert().values(name="scheduler", owner=_instance_id, expires_at=expires_at))
+            return True
+    except IntegrityError:
+        # another replica created the lease first
+        return False
+    except Exception as e:
+        logger.warning(f"Could not reach the scheduler lease: {e}")
+        return False
+
+
+def _release_leadership():
+    # lets another replica take over right away instead of after the lease expires
+    try:
+        with _index_engine.begin() as connection:
+            connection.execute(
+                update(_leader_table)
+                .where(_leader_table.c.name == "scheduler")
+                .where(_leader_table.c.owner == _instance_id)
+                .values(expires_at=0.0)
+            )
+    except Exception as e:
+        logger.warning(f"Could not release the scheduler lease: {e}")
+
+
+def _lead(scheduler, leader):
+    """
+    Runs for the lifetime of the process: followers wait for the lease to expire, the leader
+    renews it and pauses its scheduler as soon as a renewal fails.
+    """
+    while True:
+        if leader:
+            time.sleep(SCHEDULER_LEASE_SECONDS / 3)
+            if not _try_acquire_leadership():
+                logger.warning("Lost the scheduler lease, no longer running scheduled jobs.")
+                scheduler.pause()
+                leader = False
+        else:
+            time.sleep(SCHEDULER_POLL_SECONDS)
+            if _try_acquire_leadership():
+                logger.info("Acquired the scheduler lease, this process now runs scheduled jobs.")
+                scheduler.resume()
+                leader = True
+
+
+def get_scheduler():
+    global _scheduler, _index_engine
+    with _scheduler_lock:
+        if _scheduler is None:
+            # the scheduler's own executor only dispatches, tasks run on _task_pool
+            engine = create_engine(SCHEDULER_DB_URL)
+            _index_metadata.create_all(engine)
+            _index_engine = engine
+            scheduler = BackgroundScheduler(
+                jobstores={
+                    "default": SQLAlchemyJobStore(engine=engine),
+                    "local": MemoryJobStore()
+                },
+                job_defaults={
+                    "coalesce": True,
+                    "misfire_grace_time": SCHEDULER_MISFIRE_GRACE,
+                    "max_instances": 1
+                },
+                timezone="UTC"
+            )
+            scheduler.add_listener(_job_listener, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+            scheduler.add_listener(_index_listener, EVENT_JOB_REMOVED | EVENT_ALL_JOBS_REMOVED)
+            scheduler.add_listener(_lag_listener, EVENT_JOB_SUBMITTED)
+            # followers still write jobs to the shared store, they just don't run them
+            leader = _try_acquire_leadership()
+            scheduler.start(paused=not leader)
+            _backfill_index(scheduler)
+            scheduler.add_job(
+                _poll_job_store, "interval", seconds=SCHEDULER_POLL_SECONDS,
+                id="job_store_poll", jobstore="local", replace_existing=True
+            )
+            if not leader:
+                logger.info("Scheduler lease held by another replica, scheduling jobs without running them.")
+            threading.Thread(target=_lead, args=(scheduler, leader), daemon=True, name="scheduler_lease").start()
+            atexit.register(_release_leadership)
+            _scheduler = scheduler
+        return _scheduler
+
+
+def _reserve_rate_slot(user_id):
+    """
+    Per-user token bucket kept as the time its next token frees up. Every call reserves a token,
+    so tasks arriving in a burst get consecutive slots instead of all waking at once.
+    Returns 0 if the task may run now, otherwise the seconds until its reserved slot.
+    """
+    interval = 60 / SCHEDULER_USER_RATE
+    now = time.time()
+    with _rate_lock:
+        next_free = max(_rate_buckets.get(user_id, now), now)
+        _rate_buckets[user_id] = next_free + interval
+    # up to SCHEDULER_USER_BURST tokens may be taken ahead of the steady rate
+    return max(0.0, next_free - (SCHEDULER_USER_BURST - 1) * interval - now)
+
+
+def run_user_task(user_id, task_data, slot_reserved=False):
+    """
+    Job entry point. Lives at module level so the persistent job store can reference it by name.
+    Hands the task to the shared pool; blocks only when SCHEDULER_MAX_QUEUE tasks are already waiting.
+    Rate-limited tasks are re-queued as a persistent one-off job at their reserved slot.
+    """
+    wait = 0 if slot_reserved else _reserve_rate_slot(user_id)
+    if wait > 0:
+        with _metrics_lock:
+            _metrics["rate_limited"] += 1
+        logger.info(f"Rate limit reached for user {user_id}, delaying task by {wait:.1f}s")
+        run_date = datetime.now(timezone.utc) + timedelta(seconds=wait)
+        job = get_scheduler().add_job(
+            run_user_task, DateTrigger(run_date=run_date), args=[user_id, task_data, True],
+            id=f"user_task_{user_id}_deferred_{uuid.uuid4().hex}"
+        )
+        _index_job(user_id, job.id)
+        return
+
+    _task_slots.acquire()
+    with _metrics_lock:
+        _metrics["queue_depth"] += 1
+    _task_pool.submit(_execute_task, user_id, task_data, time.monotonic())
+
+
+def _execute_task(user_id, task_data, enqueued_at):
+    queue_wait = time.monotonic() - enqueued_at
+    with _metrics_lock:
+        _metrics["queue_depth"] -= 1
+        _metrics["running"] += 1
+        _metrics["last_queue_wait"] = queue_wait
+        _metrics["max_queue_wait"] = max(_metrics["max_queue_wait"], queue_wait)
+
+    failed = False
+    try:
+        message_worker = getattr(_thread_state, "message_worker", None)
+        if message_worker is None:
+            message_worker = _thread_state.message_worker = MessageWorker()
+
+        logger.info(f"Executing scheduled task for user {user_id}: {task_data}")
+        user_message = task_data['message']
+        orchestrator_message = task_data.get('orchestrator_message', "Default orchestrator message")
+
+        msg_state = MessageState(
+            user_message={"history": user_message},
+            orchestrator_message=orchestrator_message,
+            sys_instruct="Sample instruction"
+        )
+
+        result = message_worker.execute(msg_state)
+        logger.info(f"Task executed for user {user_id}: {result}")
+    except Exception as e:
+        failed = True
+        logger.error(f"Scheduled task for user {user_id} failed: {e}")
+    finally:
+        with _metrics_lock:
+            _metrics["running"] -= 1
+            _metrics["failed" if failed else "completed"] += 1
+        _task_slots.release()
+
+
 @register_worker
 class SchedulerWorker(BaseWorker):
     """
@@ -22,41 +354,33 @@ class SchedulerWorker(BaseWorker):
 
     def __init__(self):
         super().__init__()
-        self.scheduler = BackgroundScheduler()
-        self.message_worker = MessageWorker()
-        self._configure_scheduler()
-
-    def _configure_scheduler(self):
-        self.scheduler.add_listener(self._job_listener, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
-        self.scheduler.start()
+        self.scheduler = get_scheduler()
 
-    def _job_listener(self, event):
-        if event.exception:
-            logger.error(f"Job {event.job_id} failed!")
-        else:
-            logger.info(f"Job {event.job_id} executed successfully.")
-
-    def schedule_user_task(self, user_id, task_time, task_data):
+    def schedule_user_task(self, user_id, task_time, task_data, trigger=None):
         """
         Schedule a task and create a Google Calendar event.
+        Pass an APScheduler trigger (e.g. IntervalTrigger, CronTrigger) for a recurring task;
+        task_time is then the first occurrence and still identifies the job.
         """
-        trigger = DateTrigger(run_date=task_time)
+        if trigger is None:
+            trigger = DateTrigger(run_date=task_time)
         job_id = f"user_task_{user_id}_{task_time}"
-        self.scheduler.add_job(self.execute_user_task, trigger, args=[user_id, task_data], id=job_id)
+        self.scheduler.add_job(run_user_task, trigger, args=[user_id, task_data], id=job_id, replace_existing=True)
+        _index_job(user_id, job_id)
 
         logger.info(f"Task scheduled for user {user_id} at {task_time}. Task details: {task_data}")
 
-        # Optionally create a Google Calendar event
+        # Optionally create a Google Calendar event, written in the background
         try:
-            self._create_calendar_event(task_time, task_data['message'], user_id)
+            self._create_calendar_event(task_time, task_data['message'], user_id, job_id)
         except Exception as e:
             logger.error(f"Failed to create Google Calendar event: {e}")
 
-    def _create_calendar_event(self, task_time, message, user_id):
+    def _create_calendar_event(self, task_time, message, user_id, job_id=None):
         """
-        Creates a Google Calendar event for the scheduled task.
+        Queues a Google Calendar event for the scheduled task. Inserts are batched and retried
+        by the calendar writer thread; the outcome is logged by the calendar listener.
         """
-        service = get_calendar_service()
 
         event = {
             'summary': f'Scheduled Task for User {user_id}',
@@ -71,22 +395,10 @@ class SchedulerWorker(BaseWorker):
             },
         }
 
-        created_event = service.events().insert(calendarId='primary', body=event).execute()
-        logger.info(f"Created Google Calendar event: {created_event.get('htmlLink')}")
+        insert_event_async(event, callback=_calendar_listener(job_id or f"user_task_{user_id}_{task_time}"))
 
     def execute_user_task(self, user_id, task_data):
-        logger.info(f"Executing scheduled task for user {user_id}: {task_data}")
-        user_message = task_data['message']
-        orchestrator_message = task_data.get('orchestrator_message', "Default orchestrator message")
-
-        msg_state = MessageState(
-            user_message={"history": user_message},
-            orchestrator_message=orchestrator_message,
-            sys_instruct="Sample instruction"
-        )
-
-        result = self.message_worker.execute(msg_state)
-        logger.info(f"Task executed for user {user_id}: {result}")
+        run_user_task(user_id, task_data)
     
     def execute(self, state):
         """
@@ -105,4 +417,57 @@ class SchedulerWorker(BaseWorker):
             job.remove()
             logger.info(f"Task for user {user_id} scheduled at {task_time} has been cancelled.")
         else:
-            logger.warning(f"No task found for user {user_id} at {task_time}.")
\ No newline at end of file
+            logger.warning(f"No task found for user {user_id} at {task_time}.")
+
+    def _user_jobs_in_range(self, user_id, after=None, before=None):
+        # only looks at the user's own jobs, never scans the whole job store; the index is shared
+        # by all replicas, so jobs scheduled elsewhere are found too
+        after = self._as_utc(after)
+        before = self._as_utc(before)
+        job_ids = _indexed_jobs(user_id)
+        jobs = []
+        for job_id in job_ids:
+            job = self.scheduler.get_job(job_id)
+            if job is None:
+                _unindex_job(job_id)
+                continue
+            run_time = job.next_run_time
+            if after is not None and (run_time is None or run_time < after):
+                continue
+            if before is not None and (run_time is None or run_time >= before):
+                continue
+            jobs.append(job)
+        return jobs
+
+    @staticmethod
+    def _as_utc(moment):
+        if moment is not None and moment.tzinfo is None:
+            return moment.replace(tzinfo=timezone.utc)
+        return moment
+
+    def list_user_tasks(self, user_id, after=None, before=None):
+        """
+        List a user's pending tasks, optionally limited to those next running in [after, before).
+        """
+        jobs = self._user_jobs_in_range(user_id, after, before)
+        tasks = [
+            {
+                "job_id": job.id,
+                "next_run_time": job.next_run_time,
+                "trigger": str(job.trigger),
+                "task_data": job.args[1]
+            }
+            for job in jobs
+        ]
+        return sorted(tasks, key=lambda task: task["next_run_time"] or datetime.max.replace(tzinfo=timezone.utc))
+
+    def cancel_user_tasks(self, user_id, after=None, before=None):
+        """
+        Cancel all of a user's tasks, optionally only those next running in [after, before).
+        Returns the number of cancelled tasks.
+        """
+        jobs = self._user_jobs_in_range(user_id, after, before)
+        for job in jobs:
+            job.remove()
+        logger.info(f"Cancelled {len(jobs)} task(s) for user {user_id}.")
+        return len(jobs)
\ No newline at end of file
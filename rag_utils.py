@@ -0,0 +1,749 @@
+import os
+import re
+import json
+import argparse
+import mmap
+import pickle
+import hashlib
+import logging
+import threading
+import multiprocessing
+import uuid
+import time
+import shutil
+import numpy as np
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from enum import Enum
+from collections import namedtuple
+from langchain_core.documents import Document
+from langchain_openai import OpenAIEmbeddings
+
+from arklex.utils import loader as arklex_loader
+from arklex.utils.loader import Loader
+from arklex.utils.model_config import MODEL
+from arklex.utils.model_provider_config import PROVIDER_EMBEDDINGS, PROVIDER_EMBEDDING_MODELS
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "rag_manifest.json"
+DOCUMENTS_STORE = "documents"
+CHUNKS_STORE = "chunked_documents"
+# an agent's store is a small <name>.store.json listing its records in the shared pack store
+STORE_POINTER_SUFFIX = ".store.json"
+# the Streamlit app reads chunks through custom_workers/rag_store_loader.py, but arklex itself (its
+# own runner, or any process that never imports sl.utils) still unpickles chunked_documents.pkl, so
+# the pickles are exported (and deduplicated in the blob store) unless RAG_WRITE_PICKLES=0
+WRITE_LEGACY_PICKLES = os.environ.get("RAG_WRITE_PICKLES", "1") == "1"
+
+# content-addressed store shared by all agent directories. Documents and chunks are stored once
+# per record hash in immutable packs under packs/, with their embeddings next to them; exported
+# pickles are hard-linked whole files. agents/ lists every agent directory using the store and
+# what it references, garbage collection only keeps what is listed there
+BLOB_STORE_DIR = os.environ.get("RAG_BLOB_STORE", "./agent/.blobs")
+PACKS_DIR = "packs"
+AGENTS_DIR = "agents"
+REFS_NAME = "rag_refs.json"
+STORED_SUFFIXES = (".pkl",)
+# packs this young are never collected, a concurrent build may not have referenced them yet
+PACK_GC_GRACE_SECONDS = 3600
+
+# build pipeline: concurrent crawls (capped per domain) and a process pool for chunking
+CRAWL_WORKERS = int(os.environ.get("RAG_CRAWL_WORKERS", 8))
+CRAWL_PER_DOMAIN = int(os.environ.get("RAG_CRAWL_PER_DOMAIN", 2))
+CHUNK_PROCESSES = int(os.environ.get("RAG_CHUNK_PROCESSES", os.cpu_count() or 1))
+# below this many new documents, chunking inline is cheaper than starting processes; spawned
+# workers re-import arklex, so a pool only pays off for large batches
+CHUNK_PARALLEL_MIN = 32
+# chunks per embedding request; progress is reported (and a cancelled build stops) between batches
+EMBED_BATCH_SIZE = int(os.environ.get("RAG_EMBED_BATCH_SIZE", 256))
+
+# a stored document or chunk: its text and a JSON-serializable metadata dict
+Record = namedtuple("Record", ["text", "metadata"])
+
+
+class RecordPack:
+    """
+    Read-only, memory-mapped view of one immutable pack in the blob store.
+
+    A pack is four files: <pack>.text and <pack>.meta hold every record's text and JSON metadata
+    back to back, <pack>.offsets.npy holds an (n + 1, 2) int64 array of byte offsets into them
+    and <pack>.hashes holds the 32-byte record hashes. Records are decoded on access, and
+    processes opening the same pack share one page-cached copy. Embeddings of a pack's records
+    are stored per embedding model in <pack>.<model>.vectors.npy, one row per record.
+    """
+
+    def __init__(self, pack_id):
+        self.pack_id = pack_id
+        base = _pack_base(pack_id)
+        self.offsets = np.load(f"{base}.offsets.npy", mmap_mode="r")
+        self._text = self._map(f"{base}.text")
+        self._meta = self._map(f"{base}.meta")
+
+    @staticmethod
+    def _map(path):
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def text(self, i):
+        start, end = int(self.offsets[i][0]), int(self.offsets[i + 1][0])
+        return self._text[start:end].decode("utf-8")
+
+    def metadata(self, i):
+        start, end = int(self.offsets[i][1]), int(self.offsets[i + 1][1])
+        return json.loads(self._meta[start:end].decode("utf-8"))
+
+    def vectors(self, model):
+        """
+        Returns the pack's stored embeddings for model, memory-mapped, or None if there are none.
+        """
+        try:
+            return np.load(_vectors_path(self.pack_id, model), mmap_mode="r")
+        except FileNotFoundError:
+            return None
+
+    def write_vectors(self, model, vectors):
+        path = _vectors_path(self.pack_id, model)
+        with open(f"{path}.tmp", "wb") as file:
+            np.save(file, np.asarray(vectors, dtype=np.float32))
+        os.replace(f"{path}.tmp", path)
+
+
+class ChunkStore:
+    """
+    Read-only view of an agent's document or chunk store written by write_chunk_store.
+
+    The agent directory only holds <name>.store.json, listing the packs it uses and a
+    (pack, row) reference per record; the records themselves live once per content hash in the
+    shared pack store, so consecutive agent generations share everything they have in common.
+    """
+
+    def __init__(self, agent_dir, name):
+        with open(os.path.join(agent_dir, f"{name}{STORE_POINTER_SUFFIX}"), "r") as file:
+            pointer = json.load(file)
+        self.version = pointer["version"]
+        self._packs = [RecordPack(pack_id) for pack_id in pointer["packs"]]
+        self._refs = np.asarray(pointer["records"], dtype=np.int64).reshape(-1, 2)
+
+    def __len__(self):
+        return len(self._refs)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        pack, row = self._refs[i]
+        pack = self._packs[pack]
+        return Record(pack.text(int(row)), pack.metadata(int(row)))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def vectors(self, model, embed=None):
+        """
+        Returns an (n, dim) array with the embedding of every record under model. Vectors are
+        stored once per pack row, so records shared with other agents are never embedded twice.
+        Packs without vectors are embedded with embed (a list of texts -> list of vectors) and
+        their vectors stored; without embed, returns None if any are missing.
+        """
+        pack_vectors = [pack.vectors(model) for pack in self._packs]
+        missing = [i for i, vectors in enumerate(pack_vectors) if vectors is None]
+        if missing:
+            if embed is None:
+                return None
+            texts = [self._packs[i].text(row) for i in missing for row in range(len(self._packs[i]))]
+            embedded = np.asarray(embed(texts), dtype=np.float32)
+            start = 0
+            for i in missing:
+                pack = self._packs[i]
+                pack.write_vectors(model, embedded[start:start + len(pack)])
+                pack_vectors[i] = pack.vectors(model)
+                start += len(pack)
+        if not len(self):
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([pack_vectors[pack][row] for pack, row in self._refs])
+
+    @classmethod
+    def exists(cls, agent_dir, name):
+        return os.path.exists(os.path.join(agent_dir, f"{name}{STORE_POINTER_SUFFIX}"))
+
+
+def store_version(agent_dir, name):
+    """
+    Returns the current version of a store, or None if the agent has no such store.
+    """
+    try:
+        with open(os.path.join(agent_dir, f"{name}{STORE_POINTER_SUFFIX}"), "r") as file:
+            return json.load(file)["version"]
+    except FileNotFoundError:
+        return None
+
+
+def embedding_model(provider=None):
+    """
+    Returns (model name, embeddings) for the embedding model arklex's FAISS retriever uses with
+    provider (by default the configured LLM provider).
+    """
+    provider = provider or MODEL["llm_provider"]
+    name = PROVIDER_EMBEDDING_MODELS[provider]
+    kwargs = {"model_name": name} if provider == "anthropic" else {"model": name}
+    return name, PROVIDER_EMBEDDINGS.get(provider, OpenAIEmbeddings)(**kwargs)
+
+
+def embed_texts(embeddings, texts, progress=None):
+    """
+    Embeds texts with embed_documents in batches of EMBED_BATCH_SIZE.
+    """
+    vectors = []
+    for start in range(0, len(texts), EMBED_BATCH_SIZE):
+        vectors.extend(embeddings.embed_documents(texts[start:start + EMBED_BATCH_SIZE]))
+        _report(progress, f"Embedded {len(vectors)}/{len(texts)} chunk(s)")
+    return vectors
+
+
+def record_hash(record):
+    meta = json.dumps(record.metadata, sort_keys=True, default=str)
+    return hashlib.sha256(f"{record.text}\0{meta}".encode("utf-8")).digest()
+
+def _pack_base(pack_id):
+    return os.path.join(BLOB_STORE_DIR, PACKS_DIR, pack_id)
+
+def _vectors_path(pack_id, model):
+    # model names may contain slashes (e.g. models/embedding-001)
+    return f"{_pack_base(pack_id)}.{re.sub(r'[^A-Za-z0-9_-]+', '-', model)}.vectors.npy"
+
+def _pack_ids():
+    # a pack is complete once its .hashes file exists, it is written last
+    pack_dir = os.path.join(BLOB_STORE_DIR, PACKS_DIR)
+    if not os.path.isdir(pack_dir):
+        return []
+    return sorted(name[:-len(".hashes")] for name in os.listdir(pack_dir) if name.endswith(".hashes"))
+
+def _known_records():
+    # record hash -> (pack id, row) for every record already in the pack store
+    known = {}
+    for pack_id in _pack_ids():
+        with open(f"{_pack_base(pack_id)}.hashes", "rb") as file:
+            hashes = file.read()
+        for row in range(len(hashes) // 32):
+            known.setdefault(hashes[row * 32:(row + 1) * 32], (pack_id, row))
+    return known
+
+def _write_pack(records):
+    """
+    Writes (hash, record) pairs as a new immutable pack and returns its id.
+    """
+    pack_id = uuid.uuid4().hex
+    base = _pack_base(pack_id)
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+    offsets = [(0, 0)]
+    with open(f"{base}.text", "wb") as text_file, open(f"{base}.meta", "wb") as meta_file:
+        for _, record in records:
+            text = record.text.encode("utf-8")
+            meta = json.dumps(record.metadata, default=str).encode("utf-8")
+            text_file.write(text)
+            meta_file.write(meta)
+            offsets.append((offsets[-1][0] + len(text), offsets[-1][1] + len(meta)))
+    with open(f"{base}.offsets.npy", "wb") as offsets_file:
+        np.save(offsets_file, np.asarray(offsets, dtype=np.int64))
+    with open(f"{base}.hashes.tmp", "wb") as hashes_file:
+        hashes_file.write(b"".join(digest for digest, _ in records))
+    os.replace(f"{base}.hashes.tmp", f"{base}.hashes")
+    return pack_id
+
+
+def write_chunk_store(agent_dir, name, records):
+    """
+    Writes records as <agent_dir>/<name>. Records already in the pack store (from this agent's
+    predecessors or any other agent) are referenced, only new ones are written to a new pack.
+    The pointer file is swapped in last, so a reader sees either the old or the new store.
+    Returns the number of newly stored records.
+    """
+    known = _known_records()
+    new_records = []
+    new_rows = {}
+    refs = []
+    for record in records:
+        digest = record_hash(record)
+        location = known.get(digest)
+        if location is None:
+            if digest not in new_rows:
+                new_rows[digest] = len(new_records)
+                new_records.append((digest, record))
+            location = (None, new_rows[digest])
+        refs.append(location)
+
+    new_pack = _write_pack(new_records) if new_records else None
+    packs = []
+    pack_index = {}
+    rows = []
+    for pack_id, row in refs:
+        pack_id = pack_id or new_pack
+        if pack_id not in pack_index:
+            pack_index[pack_id] = len(packs)
+            packs.append(pack_id)
+        rows.append([pack_index[pack_id], row])
+
+    # registered before the pointer is swapped in, so the packs are never unreferenced
+    _register_agent(agent_dir, name, packs)
+    _write_json(os.path.join(agent_dir, f"{name}{STORE_POINTER_SUFFIX}"),
+                {"version": uuid.uuid4().hex[:12], "packs": packs, "records": rows})
+    return len(new_records)
+
+
+def _write_json(path, obj):
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(obj, file)
+    os.replace(f"{path}.tmp", path)
+
+def _agent_entry(agent_dir):
+    key = hashlib.sha256(os.path.abspath(agent_dir).encode("utf-8")).hexdigest()[:24]
+    return os.path.join(BLOB_STORE_DIR, AGENTS_DIR, key)
+
+def _register_agent(agent_dir, name, refs):
+    """
+    Records in the blob store that agent_dir references refs (pack ids for a store, blob
+    digests for its files). Garbage collection keeps everything a registered agent references.
+    """
+    entry = _agent_entry(agent_dir)
+    os.makedirs(entry, exist_ok=True)
+    _write_json(os.path.join(entry, "agent.json"), {"agent_dir": os.path.abspath(agent_dir)})
+    _write_json(os.path.join(entry, f"{name}.json"), refs)
+
+def move_agent(src, dst):
+    """
+    Renames an agent directory and moves its blob store registration along with it.
+    """
+    os.rename(src, dst)
+    entry = _agent_entry(src)
+    if os.path.isdir(entry):
+        shutil.rmtree(_agent_entry(dst), ignore_errors=True)
+        os.rename(entry, _agent_entry(dst))
+        _write_json(os.path.join(_agent_entry(dst), "agent.json"), {"agent_dir": os.path.abspath(dst)})
+
+def delete_agent(agent_dir):
+    """
+    Deletes an agent directory and its blob store registration; what only it referenced is
+    freed by the next collect_garbage. Also drops the registration of a directory that was
+    already deleted by hand.
+    """
+    shutil.rmtree(agent_dir, ignore_errors=True)
+    shutil.rmtree(_agent_entry(agent_dir), ignore_errors=True)
+
+def registered_agents():
+    """
+    Returns {agent dir: {name: refs}} for every agent registered in the blob store.
+    """
+    agents = {}
+    agents_dir = os.path.join(BLOB_STORE_DIR, AGENTS_DIR)
+    if not os.path.isdir(agents_dir):
+        return agents
+    for key in os.listdir(agents_dir):
+        entry = os.path.join(agents_dir, key)
+        refs = {}
+        for name in os.listdir(entry):
+            if name.endswith(".json"):
+                with open(os.path.join(entry, name), "r") as file:
+                    refs[name[:-len(".json")]] = json.load(file)
+        agent = refs.pop("agent", None)
+        if agent is not None:
+            agents[agent["agent_dir"]] = refs
+    return agents
+
+
+def doc_to_record(doc):
+    # crawled objects differ between arklex versions (CrawledURLObject, CrawledObject with a
+    # SourceType enum), so the class and any enum fields are stored by name
+    state = {"__type__": type(doc).__name__}
+    for key, value in vars(doc).items():
+        if isinstance(value, Enum):
+            value = {"__enum__": type(value).__name__, "value": value.value}
+        state[key] = value
+    content = state.pop("content")
+    if content is None:
+        # e.g. local files that are read at chunking time
+        state["__no_content__"] = True
+    return Record(content or "", state)
+
+def record_to_doc(record):
+    # rebuilt the same way unpickling does, without depending on the constructor signature
+    state = dict(record.metadata)
+    doc_class = getattr(arklex_loader, state.pop("__type__"))
+    content = None if state.pop("__no_content__", False) else record.text
+    for key, value in state.items():
+        if isinstance(value, dict) and "__enum__" in value:
+            state[key] = getattr(arklex_loader, value["__enum__"])(value["value"])
+    doc = doc_class.__new__(doc_class)
+    doc.__dict__.update(state, content=content)
+    return doc
+
+def chunk_to_record(chunk):
+    return Record(chunk.page_content, dict(chunk.metadata))
+
+def record_to_chunk(record):
+    return Document(page_content=record.text, metadata=record.metadata)
+
+
+def _save_pickle(path, obj):
+    # files may be hard links into the blob store, so never rewrite them in place
+    with open(f"{path}.tmp", "wb") as file:
+        pickle.dump(obj, file)
+    os.replace(f"{path}.tmp", path)
+
+def _load_pickle(path):
+    with open(path, "rb") as file:
+        return pickle.load(file)
+
+def load_records(agent_dir, name):
+    """
+    Returns the records of a store, memory-mapped if the agent has been converted, otherwise
+    read from the legacy pickle.
+    """
+    if ChunkStore.exists(agent_dir, name):
+        return ChunkStore(agent_dir, name)
+    to_record = doc_to_record if name == DOCUMENTS_STORE else chunk_to_record
+    return [to_record(obj) for obj in _load_pickle(os.path.join(agent_dir, f"{name}.pkl"))]
+
+def convert_agent_dir(agent_dir):
+    """
+    Converts an agent directory's documents.pkl / chunked_documents.pkl to the memory-mapped format.
+    """
+    for name, to_record in ((DOCUMENTS_STORE, doc_to_record), (CHUNKS_STORE, chunk_to_record)):
+        path = os.path.join(agent_dir, f"{name}.pkl")
+        if os.path.exists(path):
+            write_chunk_store(agent_dir, name, (to_record(obj) for obj in _load_pickle(path)))
+            logger.info(f"Converted {path}")
+
+
+def source_key(rag_doc):
+    # a source is identified by everything that changes what gets crawled
+    spec = {"source": rag_doc.get("source"), "num": rag_doc.get("num") or 1, "type": rag_doc.get("type")}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()
+
+def content_hash(record):
+    return hashlib.sha256(f"{record.metadata.get('url')}\n{record.text}".encode("utf-8")).hexdigest()
+
+def load_index(agent_dir):
+    """
+    Loads the documents, chunks and manifest of a previously built agent.
+    Returns None if the agent was built without a manifest.
+    """
+    if not agent_dir:
+        return None
+    manifest_path = os.path.join(agent_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r") as file:
+        manifest = json.load(file)
+    docs = load_records(agent_dir, DOCUMENTS_STORE)
+    chunks = load_records(agent_dir, CHUNKS_STORE)
+    return docs, chunks, manifest
+
+_domain_slots = {}
+_domain_slots_lock = threading.Lock()
+
+def _domain_slot(url):
+    # politeness limit: at most CRAWL_PER_DOMAIN concurrent requests to one host
+    domain = urlparse(url).netloc or url
+    with _domain_slots_lock:
+        return _domain_slots.setdefault(domain, threading.BoundedSemaphore(CRAWL_PER_DOMAIN))
+
+def _discover_urls(rag_doc):
+    source = rag_doc.get("source")
+    with _domain_slot(source):
+        return Loader().get_all_urls(source, rag_doc.get("num") or 1)
+
+def _crawl_batch(urls):
+    # one Loader call per batch, so its crawler session is shared by all of the batch's pages
+    with _domain_slot(urls[0]):
+        return Loader().to_crawled_obj(urls)
+
+def _domain_batches(source_urls):
+    """
+    Groups the (source, page) positions of all URLs by domain and splits each domain's pages into
+    at most CRAWL_PER_DOMAIN batches.
+    """
+    by_domain = {}
+    for i, urls in enumerate(source_urls):
+        for j, url in enumerate(urls):
+            by_domain.setdefault(urlparse(url).netloc or url, []).append((i, j, url))
+    batches = []
+    for pages in by_domain.values():
+        count = min(CRAWL_PER_DOMAIN, len(pages))
+        batches.extend(pages[k::count] for k in range(count))
+    return batches
+
+def _chunk_doc(doc):
+    # module level so it can run in a worker process
+    return [chunk_to_record(chunk) for chunk in Loader.chunk([doc])]
+
+def _report(progress, message):
+    logger.info(message)
+    if progress is not None:
+        progress(message)
+
+@contextmanager
+def _cancel_on_error(pool):
+    # an executor's __exit__ waits for all queued work; when the build fails or is cancelled
+    # (the progress callback raises), drop the queued tasks and wait only for the running ones
+    with pool:
+        try:
+            yield pool
+        except BaseException:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+def _crawl_sources(rag_docs, progress=None):
+    """
+    Crawls the given sources concurrently and returns their crawled objects, one list per
+    source in input order. Progress is reported from the calling thread only, so the callback
+    may write to the Streamlit UI.
+    """
+    with _cancel_on_error(ThreadPoolExecutor(max_workers=CRAWL_WORKERS, thread_name_prefix="rag_crawl")) as pool:
+        url_futures = {pool.submit(_discover_urls, rag_doc): i for i, rag_doc in enumerate(rag_docs)}
+        source_urls = [[] for _ in rag_docs]
+        for future in as_completed(url_futures):
+            i = url_futures[future]
+            source_urls[i] = future.result()
+            _report(progress, f"Found {len(source_urls[i])} page(s) for {rag_docs[i].get('source')}")
+
+        batch_futures = {
+            pool.submit(_crawl_batch, [url for _, _, url in batch]): batch
+            for batch in _domain_batches(source_urls)
+        }
+        total = sum(len(urls) for urls in source_urls)
+        pages = [[None] * len(urls) for urls in source_urls]
+        done = 0
+        for future in as_completed(batch_futures):
+            batch = batch_futures[future]
+            # the Loader returns one crawled object per URL, in order
+            for (i, j, _), page in zip(batch, future.result()):
+                pages[i][j] = page
+            done += len(batch)
+            _report(progress, f"Crawled {done}/{total} page(s)")
+    return [[page for page in source_pages if page is not None] for source_pages in pages]
+
+def _chunk_docs(docs, progress=None):
+    if len(docs) < CHUNK_PARALLEL_MIN or CHUNK_PROCESSES <= 1:
+        return [_chunk_doc(doc) for doc in docs]
+    # spawn rather than fork: the build runs in a thread of a multi-threaded Streamlit process
+    context = multiprocessing.get_context("spawn")
+    with _cancel_on_error(ProcessPoolExecutor(max_workers=min(CHUNK_PROCESSES, len(docs)), mp_context=context)) as pool:
+        futures = {pool.submit(_chunk_doc, doc): i for i, doc in enumerate(docs)}
+        results = [None] * len(docs)
+        for done, future in enumerate(as_completed(futures), start=1):
+            results[futures[future]] = future.result()
+            _report(progress, f"Chunked {done}/{len(docs)} document(s)")
+    return results
+
+def build_rag_incremental(output_dir, rag_docs, base_dir=None, progress=None):
+    """
+    Builds the document and chunk stores for output_dir, reusing everything from the agent in
+    base_dir that is still valid: sources that were crawled before are not fetched again, and
+    documents whose content hash is unchanged keep their existing chunks. Only new sources are
+    crawled and only new or changed documents are chunked. progress, if given, is called with
+    short status messages.
+    """
+    previous = load_index(base_dir)
+    if previous is None:
+        prev_docs, prev_chunks, prev_manifest = [], [], {"sources": {}, "documents": {}}
+        if base_dir:
+            _report(progress, f"No RAG manifest in {base_dir}, building the index from scratch.")
+    else:
+        prev_docs, prev_chunks, prev_manifest = previous
+    prev_docs_by_id = {record.metadata["id"]: i for i, record in enumerate(prev_docs)}
+
+    source_docs = [None] * len(rag_docs)
+    to_crawl = []
+    for i, rag_doc in enumerate(rag_docs):
+        doc_ids = prev_manifest["sources"].get(source_key(rag_doc))
+        if doc_ids is not None and all(doc_id in prev_docs_by_id for doc_id in doc_ids):
+            _report(progress, f"Reusing crawled documents for {rag_doc.get('source')}")
+            source_docs[i] = [prev_docs[prev_docs_by_id[doc_id]] for doc_id in doc_ids]
+        else:
+            to_crawl.append(i)
+
+    crawled = {}
+    for i, objs in zip(to_crawl, _crawl_sources([rag_docs[i] for i in to_crawl], progress)):
+        source_docs[i] = []
+        for doc in objs:
+            record = doc_to_record(doc)
+            crawled[content_hash(record)] = doc
+            source_docs[i].append(record)
+
+    docs = []
+    manifest = {"sources": {}, "documents": {}}
+    for rag_doc, records in zip(rag_docs, source_docs):
+        manifest["sources"][source_key(rag_doc)] = [record.metadata["id"] for record in records]
+        docs.extend(records)
+
+    # documents without reusable chunks are chunked in parallel, then everything is laid out in order
+    unique_docs = {}
+    for record in docs:
+        unique_docs.setdefault(content_hash(record), record)
+    new_hashes = [doc_hash for doc_hash in unique_docs if doc_hash not in prev_manifest["documents"]]
+    new_chunks = dict(zip(new_hashes, _chunk_docs(
+        [crawled.get(doc_hash) or record_to_doc(unique_docs[doc_hash]) for doc_hash in new_hashes], progress
+    )))
+
+    chunks = []
+    for doc_hash in unique_docs:
+        if doc_hash in new_chunks:
+            doc_chunks = new_chunks[doc_hash]
+        else:
+            chunk_range = prev_manifest["documents"][doc_hash]
+            doc_chunks = prev_chunks[chunk_range[0]:chunk_range[1]]
+        manifest["documents"][doc_hash] = [len(chunks), len(chunks) + len(doc_chunks)]
+        chunks.extend(doc_chunks)
+    _report(progress, f"RAG index: {len(docs)} documents, {len(chunks)} chunks, "
+                      f"{len(unique_docs) - len(new_hashes)} documents reused")
+
+    stored = write_chunk_store(output_dir, DOCUMENTS_STORE, docs)
+    stored += write_chunk_store(output_dir, CHUNKS_STORE, chunks)
+    _report(progress, f"Stored {stored} new record(s), {len(docs) + len(chunks) - stored} shared with earlier agents")
+
+    # embeddings are stored with the chunks, so only chunks no earlier agent had are embedded
+    # here and the retriever (custom_workers/rag_store_loader.py) builds its index from them
+    model_name, embeddings = embedding_model()
+    embedded = []
+    def embed(texts):
+        embedded.extend(texts)
+        return embed_texts(embeddings, texts, progress)
+    ChunkStore(output_dir, CHUNKS_STORE).vectors(model_name, embed)
+    _report(progress, f"Embedded {len(embedded)} chunk(s), the others reuse stored embeddings")
+    if WRITE_LEGACY_PICKLES:
+        _save_pickle(os.path.join(output_dir, "documents.pkl"), [record_to_doc(record) for record in docs])
+        _save_pickle(os.path.join(output_dir, "chunked_documents.pkl"), [record_to_chunk(record) for record in chunks])
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w") as file:
+        json.dump(manifest, file, indent=2)
+
+    store_agent_files(output_dir)
+    collect_garbage()
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _blob_path(digest):
+    return os.path.join(BLOB_STORE_DIR, digest[:2], digest)
+
+def _link_blob(blob, path):
+    tmp_path = f"{path}.tmp"
+    try:
+        os.link(blob, tmp_path)
+    except OSError:
+        # e.g. the blob store is on another filesystem
+        with open(blob, "rb") as src, open(tmp_path, "wb") as dst:
+            dst.write(src.read())
+    os.replace(tmp_path, path)
+
+def store_agent_files(agent_dir):
+    """
+    Moves an agent's exported pickles into the blob store, keyed by content hash, and replaces
+    them with hard links. Identical files across agents share one blob.
+    The hashes are recorded in <agent_dir>/rag_refs.json.
+    """
+    refs = {}
+    for name in sorted(os.listdir(agent_dir)):
+        path = os.path.join(agent_dir, name)
+        if not name.endswith(STORED_SUFFIXES) or not os.path.isfile(path):
+            continue
+        digest = _file_digest(path)
+        blob = _blob_path(digest)
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            _link_blob(path, blob)
+            os.chmod(blob, 0o444)
+        if not os.path.samefile(blob, path):
+            _link_blob(blob, path)
+        refs[name] = digest
+    _register_agent(agent_dir, "files", refs)
+    with open(os.path.join(agent_dir, REFS_NAME), "w") as file:
+        json.dump(refs, file, indent=2)
+    return refs
+
+def restore_agent_files(agent_dir):
+    """
+    Re-creates any referenced file missing from an agent directory from the blob store.
+    """
+    refs_path = os.path.join(agent_dir, REFS_NAME)
+    if not os.path.exists(refs_path):
+        return
+    with open(refs_path, "r") as file:
+        refs = json.load(file)
+    for name, digest in refs.items():
+        path = os.path.join(agent_dir, name)
+        if not os.path.exists(path):
+            _link_blob(_blob_path(digest), path)
+
+def collect_garbage():
+    """
+    Deletes blobs and packs that no agent registered in the blob store references (see
+    delete_agent). Blobs still hard-linked from a directory and packs younger than
+    PACK_GC_GRACE_SECONDS, which a running build may not have registered yet, are kept.
+    Returns the number of bytes freed.
+    """
+    referenced = set()
+    referenced_packs = set()
+    for refs in registered_agents().values():
+        referenced.update(refs.pop("files", {}).values())
+        for packs in refs.values():
+            referenced_packs.update(packs)
+    freed = 0
+    if not os.path.isdir(BLOB_STORE_DIR):
+        return freed
+    for prefix in os.listdir(BLOB_STORE_DIR):
+        if prefix in (PACKS_DIR, AGENTS_DIR):
+            continue
+        prefix_dir = os.path.join(BLOB_STORE_DIR, prefix)
+        for digest in os.listdir(prefix_dir):
+            blob = os.path.join(prefix_dir, digest)
+            stat = os.stat(blob)
+            if stat.st_nlink == 1 and digest not in referenced:
+                freed += stat.st_size
+                os.remove(blob)
+    pack_dir = os.path.join(BLOB_STORE_DIR, PACKS_DIR)
+    if os.path.isdir(pack_dir):
+        cutoff = time.time() - PACK_GC_GRACE_SECONDS
+        for name in os.listdir(pack_dir):
+            path = os.path.join(pack_dir, name)
+            pack_id = name.split(".", 1)[0]
+            stat = os.stat(path)
+            if pack_id not in referenced_packs and stat.st_mtime < cutoff:
+                freed += stat.st_size
+                os.remove(path)
+    if freed:
+        logger.info(f"Blob store garbage collection freed {freed} bytes")
+    return freed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=["convert", "dedupe", "delete", "gc"])
+    parser.add_argument('paths', nargs="*", help="agent directories (not used by gc)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    for path in args.paths:
+        if args.command == "convert":
+            convert_agent_dir(path)
+        elif args.command == "dedupe":
+            store_agent_files(path)
+        elif args.command == "delete":
+            delete_agent(path)
+    if args.command == "gc":
+        collect_garbage()
@@ -10,10 +10,15 @@ import os
 # Set your OpenAI key from secrets
 openai.api_key = st.secrets["api_keys"]["OPEN_API_KEY"]
 
-# Typewriter effect generator
-def typewriter_stream(text, delay=0.02):
-    for char in text:
-        yield char
+# Typewriter effect generator, bounded to `budget` seconds total no matter how long the text is
+def typewriter_stream(text, budget=0.75, frames=30):
+    if not text:
+        return
+    frames = max(1, min(frames, len(text)))
+    per_frame = -(-len(text) // frames)
+    delay = budget / frames
+    for i in range(0, len(text), per_frame):
+        yield text[i:i + per_frame]
         time.sleep(delay)
 
 # Get a reply from OpenAI
@@ -40,6 +45,8 @@ def get_reply(input_string):
 def app():
     if "history" not in st.session_state:
         st.session_state.history = []
+    if "animate_reply" not in st.session_state:
+        st.session_state.animate_reply = False
 
     # Load image dynamically
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -61,7 +68,9 @@ def app():
         if message.startswith("user:"):
             st.markdown(f"**You:** {message[6:]}")
         elif message.startswith("RYAA:"):
-            if idx == len(st.session_state.history) - 1:
+            # only animate a reply the first time it is shown, later reruns render it statically
+            if idx == len(st.session_state.history) - 1 and st.session_state.animate_reply:
+                st.session_state.animate_reply = False
                 st.markdown("**RYAA:**")
                 st.write_stream(typewriter_stream(message[6:]))
             else:
@@ -74,6 +83,7 @@ def app():
         st.session_state.history.append("user: " + user_input)
         output = get_reply(user_input)
         st.session_state.history.append("RYAA: " + output)
+        st.session_state.animate_reply = True
 
         # Limit history
         if len(st.session_state.history) > 50:
@@ -1,13 +1,22 @@
 # audio_helpers.py
 import os
+import re
+import json
+import hashlib
+import threading
+import base64
+import uuid
+import httpx
 import numpy as np
 import soundfile as sf
 from openai import OpenAI
 from io import BytesIO
-from typing import IO
+from typing import IO, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from pydub import AudioSegment
 from pydub.playback import play as pydub_play
 import streamlit as st
+import streamlit.components.v1 as components
 
 
 # from arklex.utils.model_config import TRANSCRIPTION_MODEL
@@ -18,23 +27,264 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+TTS_MODEL_ID = "eleven_multilingual_v1"
+TTS_OUTPUT_FORMAT = "mp3_22050_32"
+DEFAULT_VOICE_SETTINGS = {
+    "stability": 0.5,
+    "similarity_boost": 0.75,
+    "style": 0.0,
+    "use_speaker_boost": True,
+}
+# streaming TTS: segments synthesized in parallel, the first one kept short so playback starts fast
+TTS_STREAM_WORKERS = 4
+TTS_FIRST_SEGMENT_CHARS = 120
+TTS_SEGMENT_CHARS = 400
 
-def transcribe_audio(audio_input):
+# preprocessing before Whisper: silence trim, 16 kHz mono, compact codec
+TARGET_SAMPLE_RATE = 16000
+VAD_FRAME_MS = 30
+# a frame is speech if it is within VAD_DYNAMIC_RANGE_DB of the loudest frame and above VAD_FLOOR_DB
+VAD_DYNAMIC_RANGE_DB = 35.0
+VAD_FLOOR_DB = -50.0
+VAD_PADDING_MS = 200
+
+# chunked transcription: long recordings are cut at pauses and transcribed in parallel
+CHUNK_MAX_SECONDS = 30.0
+CHUNK_MIN_SECONDS = 5.0
+CHUNKED_MIN_SECONDS = 45.0
+TRANSCRIBE_WORKERS = 4
+WHISPER_MODEL = "whisper-1"
+WHISPER_MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+
+# shared API clients: created on first use and reused so connections stay alive between turns
+AUDIO_CONNECT_TIMEOUT = float(os.environ.get("AUDIO_CONNECT_TIMEOUT", 5))
+AUDIO_READ_TIMEOUT = float(os.environ.get("AUDIO_READ_TIMEOUT", 60))
+AUDIO_POOL_CONNECTIONS = int(os.environ.get("AUDIO_POOL_CONNECTIONS", 10))
+AUDIO_KEEPALIVE_EXPIRY = float(os.environ.get("AUDIO_KEEPALIVE_EXPIRY", 60))
+
+# disk cache of synthesized audio, evicted least recently used first (file mtime is touched on hit)
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", "./agent/.tts_cache")
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+
+_openai_client = None
+_elevenlabs_client = None
+_tts_voice_id = None
+_client_lock = threading.Lock()
+_tts_cache_lock = threading.Lock()
+
+
+def _http_client() -> httpx.Client:
+    return httpx.Client(
+        timeout=httpx.Timeout(AUDIO_READ_TIMEOUT, connect=AUDIO_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=AUDIO_POOL_CONNECTIONS,
+            max_keepalive_connections=AUDIO_POOL_CONNECTIONS,
+            keepalive_expiry=AUDIO_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+def get_openai_client() -> OpenAI:
+    global _openai_client
+    with _client_lock:
+        if _openai_client is None:
+            _openai_client = OpenAI(http_client=_http_client())
+        return _openai_client
+
+
+def get_elevenlabs_client():
+    """
+    Returns the shared ElevenLabs client and the default voice id, reading st.secrets only
+    the first time.
+    """
+    global _elevenlabs_client, _tts_voice_id
+    with _client_lock:
+        if _elevenlabs_client is None:
+            elevenlabs_api_key = st.secrets["api_keys"]["ELEVENLABS_API_KEY"]
+            if not elevenlabs_api_key:
+                logger.warning(
+                    "ElevenLabs API key not found. Voice functionality will be limited."
+                )
+            _tts_voice_id = st.secrets["api_keys"]["DEFAULT_VOICE_ID"]
+            _elevenlabs_client = ElevenLabs(api_key=elevenlabs_api_key, httpx_client=_http_client())
+        return _elevenlabs_client, _tts_voice_id
+
+
+def frame_energy_db(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    """
+    RMS level in dBFS of consecutive VAD_FRAME_MS frames of a mono float signal.
+    """
+    frame_len = max(1, int(sample_rate * VAD_FRAME_MS / 1000))
+    n_frames = -(-len(samples) // frame_len)
+    padded = np.zeros(n_frames * frame_len, dtype=np.float32)
+    padded[: len(samples)] = samples
+    rms = np.sqrt(np.mean(padded.reshape(n_frames, frame_len) ** 2, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def voiced_frames(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    energy = frame_energy_db(samples, sample_rate)
+    if not len(energy):
+        return np.zeros(0, dtype=bool)
+    threshold = max(VAD_FLOOR_DB, energy.max() - VAD_DYNAMIC_RANGE_DB)
+    return energy >= threshold
+
+
+def trim_silence(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    """
+    Drops leading and trailing silence, keeping VAD_PADDING_MS around the speech.
+    Returns an empty array if nothing was loud enough to be speech.
+    """
+    voiced = np.flatnonzero(voiced_frames(samples, sample_rate))
+    if not len(voiced):
+        return samples[:0]
+    frame_len = max(1, int(sample_rate * VAD_FRAME_MS / 1000))
+    padding = int(sample_rate * VAD_PADDING_MS / 1000)
+    start = max(0, voiced[0] * frame_len - padding)
+    end = min(len(samples), (voiced[-1] + 1) * frame_len + padding)
+    return samples[start:end]
+
+
+def resample(samples: np.ndarray, sample_rate: int, target_rate: int = TARGET_SAMPLE_RATE) -> np.ndarray:
+    if sample_rate == target_rate or not len(samples):
+        return samples
+    if sample_rate > target_rate:
+        # moving-average low-pass so content above the new Nyquist doesn't alias into speech
+        width = int(np.ceil(sample_rate / target_rate))
+        if width > 1:
+            samples = np.convolve(samples, np.ones(width, dtype=np.float32) / width, mode="same")
+    duration = len(samples) / sample_rate
+    n_out = int(round(duration * target_rate))
+    src_times = np.arange(len(samples)) / sample_rate
+    dst_times = np.arange(n_out) / target_rate
+    return np.interp(dst_times, src_times, samples).astype(np.float32)
+
+
+def encode_audio(samples: np.ndarray, sample_rate: int) -> BytesIO:
+    """
+    Encodes mono samples as Ogg Vorbis, falling back to FLAC when libsndfile lacks Vorbis.
+    The returned buffer carries a file name so the OpenAI client can tell the format.
+    """
+    for fmt, subtype, name in (("OGG", "VORBIS", "audio.ogg"), ("FLAC", "PCM_16", "audio.flac")):
+        buffer = BytesIO()
+        try:
+            sf.write(buffer, samples, sample_rate, format=fmt, subtype=subtype)
+        except Exception as e:
+            logger.debug(f"Could not encode audio as {fmt}: {e}")
+            continue
+        buffer.seek(0)
+        buffer.name = name
+        return buffer
+    raise RuntimeError("No supported audio encoder available.")
+
+
+def load_audio(audio_input):
+    """
+    Reads an uploaded recording into mono float32 samples and its sample rate.
+    """
+    if hasattr(audio_input, "seek"):
+        audio_input.seek(0)
+    data, sample_rate = sf.read(audio_input, dtype="float32", always_2d=True)
+    return data.mean(axis=1), sample_rate
+
+
+def prepare_audio(audio_input) -> np.ndarray:
+    """
+    Loads the recording, trims silence and resamples it to TARGET_SAMPLE_RATE mono.
+    The result is empty if the recording contains no speech.
+    """
+    samples, sample_rate = load_audio(audio_input)
+    samples = trim_silence(samples, sample_rate)
+    return resample(samples, sample_rate)
+
+
+def preprocess_audio(audio_input):
+    """
+    Trims silence, downmixes and resamples the recording to 16 kHz mono and re-encodes it
+    compactly for upload. Returns None if the recording contains no speech.
+    """
+    samples = prepare_audio(audio_input)
+    if not len(samples):
+        return None
+    return encode_audio(samples, TARGET_SAMPLE_RATE)
+
+
+def split_on_silence(samples: np.ndarray, sample_rate: int, max_seconds: float = CHUNK_MAX_SECONDS) -> list:
+    """
+    Splits samples into chunks of at most max_seconds, cutting at the last pause inside each
+    window (or hard at max_seconds if the speaker never pauses). Returns (start, end) indices.
+    """
+    frame_len = max(1, int(sample_rate * VAD_FRAME_MS / 1000))
+    silent = np.flatnonzero(~voiced_frames(samples, sample_rate))
+    max_len = int(max_seconds * sample_rate)
+    min_len = int(min(CHUNK_MIN_SECONDS, max_seconds / 2) * sample_rate)
+    bounds = []
+    start = 0
+    while len(samples) - start > max_len:
+        # silent frames whose centre falls inside [start + min_len, start + max_len]
+        centres = silent * frame_len + frame_len // 2
+        window = centres[(centres >= start + min_len) & (centres <= start + max_len)]
+        cut = int(window[-1]) if len(window) else start + max_len
+        bounds.append((start, cut))
+        start = cut
+    if start < len(samples):
+        bounds.append((start, len(samples)))
+    return bounds
+
+
+def _transcribe_upload(client, upload) -> str:
+    return client.audio.transcriptions.create(
+        model=WHISPER_MODEL, file=upload, response_format="text"
+    )
+
+
+def transcribe_chunks(client, samples: np.ndarray, sample_rate: int = TARGET_SAMPLE_RATE) -> str:
+    """
+    Transcribes samples chunk by chunk on a bounded thread pool and joins the texts in order.
+    """
+    chunks = [samples[start:end] for start, end in split_on_silence(samples, sample_rate)]
+    uploads = [encode_audio(chunk, sample_rate) for chunk in chunks if voiced_frames(chunk, sample_rate).any()]
+    with ThreadPoolExecutor(max_workers=TRANSCRIBE_WORKERS) as pool:
+        texts = list(pool.map(lambda upload: _transcribe_upload(client, upload), uploads))
+    return " ".join(text.strip() for text in texts if text and text.strip())
+
+
+def transcribe_audio(audio_input, chunked=None):
     """
     transcription using OpenAI, and return the transcription.
+    chunked=None picks chunked transcription for long or oversized recordings.
     """
     # # Convert the raw bytes to a numpy array
     # audio_data = b"".join(frames)
     # audio_array = np.frombuffer(audio_data, dtype=np.int16)
 
-    # Optional: Transcription test using OpenAI's API
+    transcription = ""
     try:
-        client = OpenAI()
-        model = "whisper-1"
+        samples = prepare_audio(audio_input)
+        if not len(samples):
+            logger.debug("No speech detected in recording.")
+            return transcription
+    except Exception as e:
+        logger.warning(f"Audio preprocessing failed, uploading original recording: {e}")
+        samples = None
 
-        transcription = client.audio.transcriptions.create(
-            model=model, file=audio_input, response_format="text"
-        )
+    # Optional: Transcription test using OpenAI's API
+    try:
+        client = get_openai_client()
+        if samples is None:
+            if hasattr(audio_input, "seek"):
+                audio_input.seek(0)
+            transcription = _transcribe_upload(client, audio_input)
+        else:
+            if chunked is None:
+                chunked = len(samples) / TARGET_SAMPLE_RATE > CHUNKED_MIN_SECONDS
+            upload = None if chunked else encode_audio(samples, TARGET_SAMPLE_RATE)
+            if upload is not None and upload.getbuffer().nbytes > WHISPER_MAX_UPLOAD_BYTES:
+                upload = None
+            if upload is None:
+                transcription = transcribe_chunks(client, samples)
+            else:
+                transcription = _transcribe_upload(client, upload)
 
         print(f"Transcribed: '{transcription}'")
         # FIXME: take result and pass it into the message queue
@@ -44,54 +294,186 @@ def transcribe_audio(audio_input):
     return transcription
 
 
-def tts_conversion(text: str) -> IO[bytes]:
-    # Get API key from environment
-    elevenlabs_api_key = st.secrets["api_keys"]["ELEVENLABS_API_KEY"]
-    if not elevenlabs_api_key:
-        logger.warning(
-            "ElevenLabs API key not found. Voice functionality will be limited."
-        )
+def _synthesize(client, text: str, voice_id: str) -> bytes:
+    response = client.text_to_speech.convert(
+        text=text,
+        voice_id=voice_id,
+        model_id=TTS_MODEL_ID,
+        output_format=TTS_OUTPUT_FORMAT,
+        voice_settings=VoiceSettings(
+            stability=DEFAULT_VOICE_SETTINGS["stability"],
+            similarity_boost=DEFAULT_VOICE_SETTINGS["similarity_boost"],
+            style=DEFAULT_VOICE_SETTINGS["style"],
+            use_speaker_boost=DEFAULT_VOICE_SETTINGS["use_speaker_boost"],
+        ),
+    )
+    return b"".join(chunk for chunk in response if chunk)
 
-    # Initialize ElevenLabs client
-    client = ElevenLabs(api_key=elevenlabs_api_key)
 
-    # Default voice settings
-    default_voice_id = st.secrets["api_keys"]["DEFAULT_VOICE_ID"]
+def tts_cache_key(text: str, voice_id: str) -> str:
+    # whitespace is normalized but case and punctuation are kept since they change the prosody
+    normalized = " ".join(text.split())
+    key = [normalized, voice_id, TTS_MODEL_ID, TTS_OUTPUT_FORMAT, DEFAULT_VOICE_SETTINGS]
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
 
-    default_voice_settings = {
-        "stability": 0.5,
-        "similarity_boost": 0.75,
-        "style": 0.0,
-        "use_speaker_boost": True,
-    }
 
+def _tts_cache_get(key: str):
+    path = os.path.join(TTS_CACHE_DIR, f"{key}.mp3")
     try:
-        logger.debug("Starting TTS conversion.")
-        response = client.text_to_speech.convert(
-            text=text,
-            voice_id=default_voice_id,
-            model_id="eleven_multilingual_v1",
-            output_format="mp3_22050_32",
-            voice_settings=VoiceSettings(
-                stability=default_voice_settings["stability"],
-                similarity_boost=default_voice_settings["similarity_boost"],
-                style=default_voice_settings["style"],
-                use_speaker_boost=default_voice_settings["use_speaker_boost"],
-            ),
-        )
+        with open(path, "rb") as f:
+            audio = f.read()
+        os.utime(path)
+        return audio
+    except OSError:
+        return None
+
+
+def _tts_cache_put(key: str, audio: bytes):
+    try:
+        os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+        path = os.path.join(TTS_CACHE_DIR, f"{key}.mp3")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(audio)
+        os.replace(tmp_path, path)
+        with _tts_cache_lock:
+            _evict_tts_cache()
+    except OSError as e:
+        logger.warning(f"Could not write TTS cache entry: {e}")
+
+
+def _evict_tts_cache():
+    entries = []
+    total = 0
+    with os.scandir(TTS_CACHE_DIR) as it:
+        for entry in it:
+            if not entry.name.endswith(".mp3"):
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+    entries.sort()
+    for _, size, path in entries:
+        if total <= TTS_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
 
-        audio_stream = BytesIO()
 
-        for chunk in response:
-            if chunk:
-                audio_stream.write(chunk)
+def synthesize_cached(client, text: str, voice_id: str) -> bytes:
+    """
+    Returns the audio for text from the disk cache, synthesizing and storing it on a miss.
+    """
+    key = tts_cache_key(text, voice_id)
+    audio = _tts_cache_get(key)
+    if audio is not None:
+        logger.debug("TTS cache hit.")
+        return audio
+    audio = _synthesize(client, text, voice_id)
+    if audio:
+        _tts_cache_put(key, audio)
+    return audio
+
 
+def tts_conversion(text: str) -> IO[bytes]:
+    client, default_voice_id = get_elevenlabs_client()
+
+    try:
+        logger.debug("Starting TTS conversion.")
+        audio_stream = BytesIO(synthesize_cached(client, text, default_voice_id))
         audio_stream.seek(0)
         return audio_stream
     except Exception as e:
         logger.error(f"TTS conversion failed.{e}")
 
 
+def split_sentences(text: str) -> list:
+    """
+    Split text at sentence boundaries into segments for streaming TTS. The first segment is
+    kept short so it synthesizes quickly; later sentences are grouped up to TTS_SEGMENT_CHARS.
+    """
+    sentences = [s for s in re.split(r"(?<=[.!?;:])\s+|\n+", text.strip()) if s.strip()]
+    segments = []
+    current = ""
+    for sentence in sentences:
+        limit = TTS_FIRST_SEGMENT_CHARS if not segments else TTS_SEGMENT_CHARS
+        if current and len(current) + len(sentence) + 1 > limit:
+            segments.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        segments.append(current)
+    return segments
+
+
+def tts_stream(text: str) -> Iterator[bytes]:
+    """
+    Streaming TTS: synthesizes sentence-sized segments concurrently and yields each segment's
+    audio (mp3 bytes) in order as soon as it and all segments before it are ready.
+    """
+    client, default_voice_id = get_elevenlabs_client()
+    segments = split_sentences(text)
+    with ThreadPoolExecutor(max_workers=TTS_STREAM_WORKERS) as pool:
+        futures = [pool.submit(synthesize_cached, client, segment, default_voice_id) for segment in segments]
+        for future in futures:
+            try:
+                yield future.result()
+            except Exception as e:
+                logger.error(f"TTS conversion failed for segment.{e}")
+
+
+# Browser-side player shared by all segment iframes. It lives on the parent window (the
+# component iframes are same-origin) so playback continues across script reruns.
+_PLAYER_JS = """
+<script>
+const host = window.parent;
+if (!host.ryaaTtsPlayer) {
+  host.ryaaTtsPlayer = {queue: [], audio: null, reply: null};
+  // created in the parent realm so it keeps working after this iframe is removed
+  host.ryaaTtsPlayer.next = new host.Function(`
+    const player = window.ryaaTtsPlayer;
+    if (player.audio || !player.queue.length) return;
+    player.audio = new Audio(player.queue.shift());
+    player.audio.onended = player.audio.onerror = () => { player.audio = null; player.next(); };
+    player.audio.play().catch(() => { player.audio = null; });
+  `);
+}
+const player = host.ryaaTtsPlayer;
+if (player.reply !== "__REPLY__") {
+  // a new reply interrupts whatever is still playing from the previous one
+  player.reply = "__REPLY__";
+  player.queue = [];
+  if (player.audio) { player.audio.pause(); player.audio = null; }
+}
+player.queue.push("data:audio/mpeg;base64,__AUDIO__");
+player.next();
+</script>
+"""
+
+
+def play_tts_stream(text: str) -> bytes:
+    """
+    Synthesizes text with tts_stream and queues each segment in the browser as soon as it is
+    ready; the browser plays them back to back, so the script never waits for playback.
+    Returns the audio of the whole reply.
+    """
+    reply_id = uuid.uuid4().hex
+    segments = []
+    for segment in tts_stream(text):
+        if not segment:
+            continue
+        segments.append(segment)
+        html = _PLAYER_JS.replace("__REPLY__", reply_id).replace(
+            "__AUDIO__", base64.b64encode(segment).decode("ascii")
+        )
+        components.html(html, height=0)
+    return b"".join(segments)
+
+
 # def combined_audio(audio_chunks, audio_format="mp3"):
 #     """
 #     Combine a list of audio chunk events into one continuous audio stream and play it.
@@ -3,17 +3,30 @@ import json
 import argparse
 import time
 import logging
+import threading
+import queue
+import uuid
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 import streamlit as st
 from dotenv import load_dotenv
 from pprint import pprint
 import argparse
 import create 
+from rag_utils import move_agent, delete_agent
 
 from arklex.utils.utils import init_logger
 from arklex.orchestrator.orchestrator import AgentOrg
 from arklex.utils.model_config import MODEL
 from arklex.utils.model_provider_config import LLM_PROVIDERS
 from arklex.env.env import Env
+from arklex.types import StreamType
+
+from custom_workers.rag_store_loader import install_store_loader
+
+# FaissRAGWorker reads chunks from the memory-mapped store and keeps its retriever warm
+install_store_loader()
 
 worker_colors = {
     "MessageWorker": "blue",
@@ -29,18 +42,112 @@ worker_names = {
     "RequestWorker": "User API"
 }
 
+# loads an agent's task graph and builds its worker Env once per (dir, file version);
+# streamlit reruns with an unchanged taskgraph.json reuse the cached pair
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _build_agent_env(input_dir, mtime_ns, size):
+    with open(os.path.join(input_dir, "taskgraph.json"), "r") as file:
+        config = json.load(file)
+    env = Env(
+        tools = config.get("tools", []),
+        workers = config.get("workers", []),
+        slotsfillapi = config["slotfillapi"]
+    )
+    return config, env
+
+def load_agent_env(input_dir):
+    stat = os.stat(os.path.join(input_dir, "taskgraph.json"))
+    return _build_agent_env(os.path.abspath(input_dir), stat.st_mtime_ns, stat.st_size)
+
+# process-wide registry of warm orchestrators, most recently used last
+ORCHESTRATOR_CACHE_SIZE = 8
+_orchestrators = OrderedDict()
+_orchestrators_lock = threading.Lock()
+
+# builds (or reuses) the orchestrator for an agent directory, rebuilt only when
+# the task graph file, the selected model or the worker env changes
+def get_orchestrator(input_dir, env):
+    taskgraph_path = os.path.join(input_dir, "taskgraph.json")
+    stat = os.stat(taskgraph_path)
+    key = (
+        os.path.abspath(input_dir),
+        stat.st_mtime_ns,
+        stat.st_size,
+        MODEL["model_type_or_path"],
+        MODEL["llm_provider"],
+        id(env)
+    )
+    with _orchestrators_lock:
+        orchestrator = _orchestrators.get(key)
+        if orchestrator is not None:
+            _orchestrators.move_to_end(key)
+            return orchestrator
+
+        orchestrator = AgentOrg(config=taskgraph_path, env=env)
+        _orchestrators[key] = orchestrator
+        while len(_orchestrators) > ORCHESTRATOR_CACHE_SIZE:
+            _orchestrators.popitem(last=False)
+    return orchestrator
+
+def clear_orchestrators():
+    with _orchestrators_lock:
+        _orchestrators.clear()
+
 # derived from Arklex, "run.py" file
 def agent_response(input_dir, history, user_text, parameters, env):
     data = {"text": user_text, 'chat_history': history, 'parameters': parameters}
-    orchestrator = AgentOrg(config=os.path.join(input_dir, "taskgraph.json"), env=env)
+    orchestrator = get_orchestrator(input_dir, env)
     result = orchestrator.get_response(data)
 
     return result['answer'], result['parameters'], result['human_in_the_loop']
 
-def gen_stream(text, delay=0.025):
-    test_list = text.split()
-    for word in test_list:
-        yield word + " "
+# streaming variant of agent_response: runs the orchestrator in a background thread and
+# yields LLM tokens as the workers push them onto the message queue. The final answer,
+# parameters and human-in-the-loop flag are written into `result` once the turn is done.
+def agent_response_stream(input_dir, history, user_text, parameters, env, result):
+    data = {"text": user_text, 'chat_history': history, 'parameters': parameters}
+    orchestrator = get_orchestrator(input_dir, env)
+    message_queue = queue.Queue()
+
+    def run():
+        try:
+            result.update(orchestrator.get_response(data, stream_type=StreamType.TEXT, message_queue=message_queue))
+        except Exception as e:
+            result["error"] = e
+        finally:
+            message_queue.put(None)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+
+    streamed = False
+    while True:
+        item = message_queue.get()
+        if item is None:
+            break
+        chunk = item.get("message_chunk") if isinstance(item, dict) else item
+        if chunk:
+            streamed = True
+            yield chunk
+    thread.join()
+
+    if "error" in result:
+        raise result["error"]
+    # workers that don't stream (e.g. RequestWorker) only produce the final answer
+    if not streamed and result.get("answer"):
+        yield result["answer"]
+
+# paces already-complete text over a bounded total duration: words are grouped into at
+# most `frames` chunks, so a long answer costs at most `budget` seconds regardless of length
+def gen_stream(text, budget=0.5, frames=20):
+    words = text.split()
+    if not words:
+        return
+    frames = max(1, min(frames, len(words)))
+    per_frame = -(-len(words) // frames)
+    delay = budget / frames
+    for i in range(0, len(words), per_frame):
+        yield " ".join(words[i:i + per_frame]) + " "
         time.sleep(delay)
 
 # searches trajectory used by system to determine workers used
@@ -88,10 +195,13 @@ def load_secrets():
     for name, key in st.secrets.api_keys.items():
         os.environ[name] = key
 
-def gen_agent(config_path, model_option, model_provider):
+def gen_agent(config_path, model_option, model_provider, output_dir, base_dir=None, progress=None):
     args = argparse.Namespace()
     args.config = config_path
-    args.output_dir = f"./agent/api_agent{st.session_state.gen_counter}"
+    args.output_dir = output_dir
+    # the current agent's crawled documents are reused, only new rag_docs get fetched
+    args.base_dir = base_dir
+    args.progress = progress
     args.model = model_option
     args.llm_provider = model_provider
     args.log_level = "INFO"
@@ -101,4 +211,102 @@ def gen_agent(config_path, model_option, model_provider):
         os.makedirs(args.output_dir, exist_ok=True)
 
     create.generate_taskgraph(args)
-    create.init_worker(args)
\ No newline at end of file
+    if progress is not None:
+        progress("Building the knowledge base...")
+    create.init_worker(args)
+
+# background agent builds, polled by the UI through their job id
+AGENT_BUILD_WORKERS = 2
+_build_pool = ThreadPoolExecutor(max_workers=AGENT_BUILD_WORKERS, thread_name_prefix="agent_build")
+_build_jobs = {}
+_build_jobs_lock = threading.Lock()
+
+class AgentBuildCancelled(Exception):
+    pass
+
+def _write_config(path, agent_config):
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(agent_config, file, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+def _run_agent_build(job_id, config_path, agent_config, model_option, model_provider, output_dir, base_dir):
+    job = _build_jobs[job_id]
+    # built next to the target and moved into place only once complete
+    build_dir = f"{output_dir}.building-{job_id[:8]}"
+    # the build reads its own copy of the config, config_path only changes once it succeeds
+    with tempfile.NamedTemporaryFile("w", suffix=".json", prefix=f"agent_config_{job_id[:8]}_", delete=False) as file:
+        json.dump(agent_config, file, indent=2)
+        job_config_path = file.name
+
+    def progress(message):
+        if job["cancel"].is_set():
+            raise AgentBuildCancelled()
+        with _build_jobs_lock:
+            job["messages"].append(message)
+
+    try:
+        with _build_jobs_lock:
+            job["status"] = "running"
+        progress("Generating new agent...")
+        gen_agent(job_config_path, model_option, model_provider, build_dir, base_dir, progress)
+        progress("Activating agent...")
+        # output_dir is unique to this job, an existing agent is never replaced
+        move_agent(build_dir, output_dir)
+        _write_config(config_path, agent_config)
+        status = "done"
+    except AgentBuildCancelled:
+        status = "cancelled"
+    except Exception as e:
+        logging.getLogger(__name__).exception(f"Agent build {job_id} failed")
+        status = "failed"
+        job["error"] = str(e)
+    finally:
+        # also drops the blob store registration of a cancelled or failed build
+        delete_agent(build_dir)
+        os.remove(job_config_path)
+    with _build_jobs_lock:
+        job["status"] = status
+
+def submit_agent_build(config_path, agent_config, model_option, model_provider, output_prefix, base_dir=None):
+    """
+    Starts building an agent from agent_config into <output_prefix>-<job id> and returns the job
+    id; the directory is reported as output_dir by get_agent_build. agent_config is written to
+    config_path only if the build succeeds, so a cancelled or failed build leaves it unchanged.
+    """
+    job_id = uuid.uuid4().hex
+    output_dir = f"{output_prefix}-{job_id[:12]}"
+    with _build_jobs_lock:
+        _build_jobs[job_id] = {
+            "status": "queued",
+            "messages": [],
+            "error": None,
+            "output_dir": output_dir,
+            "cancel": threading.Event()
+        }
+        _build_jobs[job_id]["future"] = _build_pool.submit(
+            _run_agent_build, job_id, config_path, agent_config, model_option, model_provider, output_dir, base_dir
+        )
+    return job_id
+
+def get_agent_build(job_id):
+    with _build_jobs_lock:
+        job = _build_jobs[job_id]
+        return {
+            "status": job["status"],
+            "messages": list(job["messages"]),
+            "error": job["error"],
+            "output_dir": job["output_dir"]
+        }
+
+# cancellation is cooperative: a running build stops at its next progress step (each task graph
+# generator LLM call, crawled page batch, chunked document and embedding batch reports progress)
+def cancel_agent_build(job_id):
+    with _build_jobs_lock:
+        job = _build_jobs[job_id]
+        job["cancel"].set()
+        if job["future"].cancel():
+            job["status"] = "cancelled"
+
+def forget_agent_build(job_id):
+    with _build_jobs_lock:
+        _build_jobs.pop(job_id, None)
@@ -4,21 +4,23 @@ import time
 import streamlit as st
 from dotenv import load_dotenv
 
-from sl.utils import agent_response, gen_stream, gen_worker_list, display_workers, get_model_provider, load_secrets, gen_agent
+from sl.utils import agent_response_stream, gen_worker_list, display_workers, get_model_provider, load_secrets, load_agent_env, submit_agent_build, get_agent_build, cancel_agent_build, forget_agent_build
 load_secrets()
-from sl.audio_utils import transcribe_audio, tts_conversion
+from sl.audio_utils import transcribe_audio, play_tts_stream
 
 from arklex.utils.utils import init_logger
 from arklex.orchestrator.orchestrator import AgentOrg
 from arklex.utils.model_config import MODEL
 from arklex.utils.model_provider_config import LLM_PROVIDERS
-from arklex.env.env import Env
 
 
 if "custom_keys" not in st.session_state:
     st.session_state.custom_keys = []
 if "gen_counter" not in st.session_state:
     st.session_state.gen_counter = 0
+if "agent_dir" not in st.session_state:
+    # builds go to a directory unique to their job, so the active one is tracked here
+    st.session_state.agent_dir = "./agent/api_agent0"
 if "agent_btn_disabled" not in st.session_state:
     st.session_state.agent_btn_disabled = True
 
@@ -34,12 +36,7 @@ if "INPUT_DIR" not in st.session_state:
     #ryaa_test
     st.session_state.INPUT_DIR = "./agent/api_agent0"
     os.environ["DATA_DIR"] = st.session_state.INPUT_DIR
-    st.session_state.config = json.load(open(os.path.join(st.session_state.INPUT_DIR, "taskgraph.json")))
-    st.session_state.env = Env(
-        tools = st.session_state.config.get("tools", []),
-        workers = st.session_state.config.get("workers", []),
-        slotsfillapi = st.session_state.config["slotfillapi"]
-    )
+    st.session_state.config, st.session_state.env = load_agent_env(st.session_state.INPUT_DIR)
 
 MODEL["model_type_or_path"] = "gpt-4.1"
 LOG_LEVEL = "WARNING"
@@ -86,12 +83,8 @@ def reset_config(debug=True):
         data_dir = st.session_state.INPUT_DIR
         os.environ["DATA_DIR"] = data_dir
         if debug: st.write(os.environ["DATA_DIR"])
-        st.session_state.config = json.load(open(os.path.join(data_dir, "taskgraph.json")))
-        st.session_state.env = Env(
-            tools = st.session_state.config.get("tools", []),
-            workers = st.session_state.config.get("workers", []),
-            slotsfillapi = st.session_state.config["slotfillapi"]
-        )
+        # cached per agent dir and taskgraph.json version, so plain reruns don't rebuild the Env
+        st.session_state.config, st.session_state.env = load_agent_env(data_dir)
         if debug: 
             st.write(st.session_state.config)
             st.write(load_json(os.path.join(data_dir, "taskplanning.json")))
@@ -138,7 +131,7 @@ with st.sidebar:
     voice = st.toggle("Voice")
     voice_output = st.toggle("Voice Output")
     debug = st.toggle("Debug Mode", value=False)
-    config_option = f"./agent/api_agent{st.session_state.gen_counter}"
+    config_option = st.session_state.agent_dir
     #config_option = st.selectbox(
     #    "Agent",
     #    ("./agent/blb_agent",
@@ -179,37 +172,67 @@ with st.sidebar:
             st.session_state.agent_btn_disabled = False
             #st.rerun()
     with col4:
-        if st.button("Load Agent", disabled=st.session_state.agent_btn_disabled):
+        # one build per session at a time, a second one would start from the same agent
+        building = "build_job" in st.session_state
+        if st.button("Load Agent", disabled=st.session_state.agent_btn_disabled or building):
             if debug: st.write(st.session_state.tmp_api_info)
-            with st.status("Creating New Agent..."):
-                st.session_state.gen_counter += 1
-                st.session_state.custom_keys.append(st.session_state.tmp_api_info["api_name"])
-                os.environ[st.session_state.tmp_api_info["api_name"]] = st.session_state.tmp_api_info["api_key"]
-                st.write("Opening config...")
-                with open(config_path, "r") as file:
-                    agent_config = json.load(file)
-                rag_doc = {
-                    "source": st.session_state.tmp_api_info["docs_link"],
-                    "desc": st.session_state.tmp_api_info["api_desc"],
-                    "num": 1
-                }
-    
-                agent_config["rag_docs"].append(rag_doc)
-                st.write("Writing to config...")
-                with open(config_path, "w") as file:
-                    json.dump(agent_config, file, indent=2)
-                #st.success(f"New Doc Added {rag_link}")
-                st.write("Generating new agent...")
-                gen_agent(config_path,model_option, get_model_provider(model_option))
-                st.write("Clearing chat...")
-                st.session_state.tmp_api_info = {key: None for key in st.session_state.tmp_api_info}
-                st.session_state.INPUT_DIR = f"./agent/api_agent{st.session_state.gen_counter}"
-                reset_config(debug)
-                blank_slate()
-                #st.rerun()
-                st.session_state.agent_btn_disabled = True
-                
+            with open(config_path, "r") as file:
+                agent_config = json.load(file)
+            rag_doc = {
+                "source": st.session_state.tmp_api_info["docs_link"],
+                "desc": st.session_state.tmp_api_info["api_desc"],
+                "num": 1
+            }
 
+            agent_config["rag_docs"].append(rag_doc)
+            #st.success(f"New Doc Added {rag_link}")
+            # the build runs in the background; the chat keeps using the current agent until it
+            # finishes, and the config and API key only change if it succeeds
+            st.session_state.build_job = submit_agent_build(
+                config_path, agent_config, model_option, get_model_provider(model_option),
+                f"./agent/api_agent{st.session_state.gen_counter + 1}", st.session_state.INPUT_DIR
+            )
+            st.session_state.pending_api_info = dict(st.session_state.tmp_api_info)
+            st.session_state.tmp_api_info = {key: None for key in st.session_state.tmp_api_info}
+            st.session_state.agent_btn_disabled = True
+
+    @st.fragment(run_every=1)
+    def agent_build_status():
+        job_id = st.session_state.get("build_job")
+        if job_id is None:
+            if st.session_state.get("build_notice"):
+                st.warning(st.session_state.build_notice)
+            return
+        job = get_agent_build(job_id)
+        if job["status"] in ("queued", "running"):
+            with st.status("Creating New Agent...", expanded=True):
+                for message in job["messages"]:
+                    st.write(message)
+            if st.button("Cancel", key="cancel_build"):
+                cancel_agent_build(job_id)
+            return
+
+        forget_agent_build(job_id)
+        del st.session_state.build_job
+        st.session_state.build_notice = None
+        api_info = st.session_state.pop("pending_api_info", None)
+        if job["status"] == "done":
+            # swap to the new agent only now that it is fully built
+            if api_info is not None:
+                st.session_state.custom_keys.append(api_info["api_name"])
+                os.environ[api_info["api_name"]] = api_info["api_key"]
+            st.session_state.gen_counter += 1
+            st.session_state.agent_dir = job["output_dir"]
+            st.session_state.INPUT_DIR = job["output_dir"]
+            blank_slate()
+        elif job["status"] == "failed":
+            st.session_state.build_notice = f"Agent creation failed: {job['error']}"
+        else:
+            st.session_state.build_notice = "Agent creation cancelled."
+        # full rerun so the Load Agent button is enabled again
+        st.rerun()
+
+    agent_build_status()
 
 
 # Chat History Rendering
@@ -249,20 +272,18 @@ if prompt:
         logo.empty()
     st.session_state.history.append({"role": USER_PREFIX, "content": prompt})
     st.session_state.workers.append("")    
-    with st.spinner("Loading..."):
-        output, st.session_state.params, hitl = agent_response(st.session_state.INPUT_DIR, st.session_state.history, 
-                                                               prompt, st.session_state.params, st.session_state.env)
-        
-        workers, sources = gen_worker_list(st.session_state.params) 
 
     with st.chat_message("assistant", avatar=LOGO_MICRO):
+        # tokens are rendered as the orchestrator produces them
+        result = {}
+        streamed_output = st.write_stream(agent_response_stream(st.session_state.INPUT_DIR, st.session_state.history,
+                                                                prompt, st.session_state.params, st.session_state.env, result))
+        output = result.get("answer", streamed_output)
+        st.session_state.params = result["parameters"]
+        hitl = result["human_in_the_loop"]
+        workers, sources = gen_worker_list(st.session_state.params)
         if debug: 
             st.write(st.session_state.params["memory"]["trajectory"]) # 
-        st.write(output)
-        #st.write_stream(gen_stream(output, delay=0.0001))
-        if voice_output:
-            audio_output = tts_conversion(output)
-            st.audio(audio_output, autoplay=True)
         detail_col1, detail_col2 = st.columns([0.5,2], vertical_alignment='center')
         with detail_col1:
             display_workers(workers)
@@ -271,9 +292,14 @@ if prompt:
                     with st.expander("Sources Used"):
                         for source in sources:
                             st.write(source)
-
-    st.session_state.history.append({"role": WORKER_PREFIX, "content": output})
-    st.session_state.workers.append(workers)
+        # saved before voice output so a rerun during synthesis never loses the reply
+        st.session_state.history.append({"role": WORKER_PREFIX, "content": output})
+        st.session_state.workers.append(workers)
+        if voice_output:
+            # segments are queued in the browser and played back to back while the rest is synthesized
+            full_audio = play_tts_stream(output)
+            if full_audio:
+                st.audio(full_audio, format="audio/mpeg")
 
 
     #st.rerun()
\ No newline at end of file
@@ -0,0 +1,34 @@
+import timeit
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from langchain.prompts import PromptTemplate
+
+from custom_workers.api_worker import RequestWorker, formatter_template
+
+# Micro-benchmark for the setup RequestWorker used to redo on every execute(): compiling the
+# LangGraph workflow and rebuilding the formatter PromptTemplate. arklex's Env builds a new
+# worker on every step, so constructing a RequestWorker is what each turn actually pays.
+# Run with: python tests/bench_api_worker.py
+N = 200
+
+# skip __init__ so no LLM client or API key is needed just to build the graph
+worker = RequestWorker.__new__(RequestWorker)
+workflow = worker._create_action_graph()
+compiled = workflow.compile()
+
+compile_per_call = timeit.timeit(lambda: workflow.compile(), number=N) / N
+reuse_per_call = timeit.timeit(lambda: compiled, number=N) / N
+template_per_call = timeit.timeit(lambda: PromptTemplate.from_template(formatter_template), number=N) / N
+
+# the graph, prompt, LLM chain and HTTP session are shared, so a new worker only looks them up
+construct_per_call = timeit.timeit(lambda: RequestWorker(), number=N) / N
+assert RequestWorker().graph is RequestWorker().graph
+
+print(f"graph compile per call:    {compile_per_call * 1000:.3f} ms")
+print(f"compiled graph reuse:      {reuse_per_call * 1000:.6f} ms")
+print(f"prompt template per call:  {template_per_call * 1000:.3f} ms")
+print(f"new worker per Env step:   {construct_per_call * 1000:.3f} ms")
+print(f"saved per Env step:        {(compile_per_call + template_per_call - construct_per_call) * 1000:.3f} ms")
@@ -0,0 +1,174 @@
+import json
+import sys
+import os
+from enum import Enum
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+pytest.importorskip("arklex")
+Document = pytest.importorskip("langchain_core.documents").Document
+
+import rag_utils
+
+# Builds agents twice with arklex's Loader and the embedding model replaced by fakes that record
+# what they crawl, chunk and embed, so the incremental reuse can be checked without a browser or
+# network.
+# Run with: python -m pytest tests/test_rag_incremental.py
+
+
+class FakeSourceType(Enum):
+    WEB = 1
+
+
+class FakeCrawledObject:
+    def __init__(self, id, url, content, source_type=FakeSourceType.WEB):
+        self.id = id
+        self.url = url
+        self.content = content
+        self.metadata = {"title": url, "source": url}
+        self.source_type = source_type
+        self.is_chunk = False
+        self.is_error = False
+
+
+class FakeLoader:
+    crawled = []
+    chunked = []
+
+    def get_all_urls(self, base_url, max_num):
+        return [f"{base_url}/page{k}" for k in range(max_num)]
+
+    def to_crawled_obj(self, urls):
+        FakeLoader.crawled.extend(urls)
+        return [FakeCrawledObject(f"id-{url}", url, f"text of {url} " * 3) for url in urls]
+
+    @classmethod
+    def chunk(cls, docs):
+        chunks = []
+        for doc in docs:
+            cls.chunked.append(doc.url)
+            words = doc.content.split()
+            for k in range(0, len(words), 2):
+                chunks.append(Document(page_content=" ".join(words[k:k + 2]), metadata={"source": doc.url}))
+        return chunks
+
+
+class FakeEmbeddings:
+    embedded = []
+
+    def embed_documents(self, texts):
+        FakeEmbeddings.embedded.extend(texts)
+        return [[float(len(text)), float(sum(map(ord, text)))] for text in texts]
+
+
+@pytest.fixture
+def fake_loader(monkeypatch, tmp_path):
+    FakeLoader.crawled = []
+    FakeLoader.chunked = []
+    FakeEmbeddings.embedded = []
+    monkeypatch.setattr(rag_utils, "Loader", FakeLoader)
+    monkeypatch.setattr(rag_utils, "embedding_model", lambda provider=None: ("fake-model", FakeEmbeddings()))
+    # record_to_doc looks crawled object classes and enums up on arklex's loader module
+    monkeypatch.setattr(rag_utils.arklex_loader, "FakeCrawledObject", FakeCrawledObject, raising=False)
+    monkeypatch.setattr(rag_utils.arklex_loader, "FakeSourceType", FakeSourceType, raising=False)
+    monkeypatch.setattr(rag_utils, "BLOB_STORE_DIR", str(tmp_path / ".blobs"))
+    return FakeLoader
+
+
+def _build(tmp_path, name, rag_docs, base_dir=None):
+    output_dir = tmp_path / name
+    output_dir.mkdir()
+    rag_utils.build_rag_incremental(str(output_dir), rag_docs, base_dir and str(tmp_path / base_dir))
+    with open(output_dir / rag_utils.MANIFEST_NAME) as file:
+        manifest = json.load(file)
+    chunks = list(rag_utils.ChunkStore(str(output_dir), rag_utils.CHUNKS_STORE))
+    return manifest, chunks
+
+
+def _record_texts(chunks):
+    # embeddings are stored once per record, i.e. per distinct text and metadata
+    unique = {(chunk.text, json.dumps(chunk.metadata, sort_keys=True)) for chunk in chunks}
+    return sorted(text for text, _ in unique)
+
+
+def _vectors(tmp_path, name):
+    return rag_utils.ChunkStore(str(tmp_path / name), rag_utils.CHUNKS_STORE).vectors("fake-model")
+
+
+def test_doc_record_round_trip(fake_loader):
+    doc = FakeCrawledObject("id-1", "https://example.com/a", "some text")
+    record = rag_utils.doc_to_record(doc)
+    assert record.text == "some text"
+    assert record.metadata["source_type"] == {"__enum__": "FakeSourceType", "value": 1}
+    json.dumps(record.metadata)
+
+    restored = rag_utils.record_to_doc(record)
+    assert type(restored) is FakeCrawledObject
+    assert vars(restored) == vars(doc)
+
+    # documents without content (e.g. local files) keep None rather than an empty string
+    doc.content = None
+    assert rag_utils.record_to_doc(rag_utils.doc_to_record(doc)).content is None
+
+
+def test_incremental_build_reuses_chunks(fake_loader, tmp_path):
+    first_sources = [{"source": "https://a.example", "num": 2}, {"source": "https://b.example", "num": 1}]
+    first_manifest, first_chunks = _build(tmp_path, "agent1", first_sources)
+    assert sorted(fake_loader.crawled) == ["https://a.example/page0", "https://a.example/page1", "https://b.example/page0"]
+
+    assert sorted(FakeEmbeddings.embedded) == _record_texts(first_chunks)
+
+    fake_loader.crawled = []
+    fake_loader.chunked = []
+    FakeEmbeddings.embedded = []
+    second_sources = first_sources + [{"source": "https://c.example", "num": 1}]
+    second_manifest, second_chunks = _build(tmp_path, "agent2", second_sources, base_dir="agent1")
+
+    # only the new source is crawled, chunked and embedded
+    assert fake_loader.crawled == ["https://c.example/page0"]
+    assert fake_loader.chunked == ["https://c.example/page0"]
+    assert sorted(FakeEmbeddings.embedded) == _record_texts(second_chunks[len(first_chunks):])
+    # and the stored vectors line up with the chunks, reused ones included
+    first_vectors = _vectors(tmp_path, "agent1")
+    second_vectors = _vectors(tmp_path, "agent2")
+    assert second_vectors[:len(first_chunks)].tolist() == first_vectors.tolist()
+    assert second_vectors.tolist() == FakeEmbeddings().embed_documents([chunk.text for chunk in second_chunks])
+
+    # earlier documents keep their chunk ranges and chunks, in the same order
+    for doc_hash, chunk_range in first_manifest["documents"].items():
+        assert second_manifest["documents"][doc_hash] == chunk_range
+    assert second_chunks[:len(first_chunks)] == first_chunks
+    assert len(second_chunks) > len(first_chunks)
+    assert all(chunk.metadata["source"] == "https://c.example/page0" for chunk in second_chunks[len(first_chunks):])
+
+
+def test_rebuild_without_changes_crawls_nothing(fake_loader, tmp_path):
+    sources = [{"source": "https://a.example", "num": 2}]
+    first_manifest, first_chunks = _build(tmp_path, "agent1", sources)
+    fake_loader.crawled = []
+    fake_loader.chunked = []
+    FakeEmbeddings.embedded = []
+    second_manifest, second_chunks = _build(tmp_path, "agent2", sources, base_dir="agent1")
+
+    assert fake_loader.crawled == []
+    assert fake_loader.chunked == []
+    assert FakeEmbeddings.embedded == []
+    assert second_manifest == first_manifest
+    assert second_chunks == first_chunks
+
+
+def test_new_chunks_are_embedded_in_batches(fake_loader, tmp_path, monkeypatch):
+    monkeypatch.setattr(rag_utils, "EMBED_BATCH_SIZE", 2)
+    batches = []
+    monkeypatch.setattr(FakeEmbeddings, "embed_documents",
+                        lambda self, texts: batches.append(len(texts)) or [[1.0]] * len(texts))
+    messages = []
+    output_dir = tmp_path / "agent1"
+    output_dir.mkdir()
+    rag_utils.build_rag_incremental(str(output_dir), [{"source": "https://a.example", "num": 1}],
+                                    progress=messages.append)
+
+    assert max(batches) == 2
+    assert f"Embedded {sum(batches)}/{sum(batches)} chunk(s)" in messages
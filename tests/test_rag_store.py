@@ -0,0 +1,104 @@
+import sys
+import os
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+pytest.importorskip("arklex")
+pytest.importorskip("langchain_core")
+
+import rag_utils
+from rag_utils import Record, ChunkStore
+
+# Exercises the content-addressed pack store: records shared between agents are written once,
+# and garbage collection only frees what no registered agent references, wherever it lives.
+# Run with: python -m pytest tests/test_rag_store.py
+
+
+@pytest.fixture
+def blob_store(monkeypatch, tmp_path):
+    monkeypatch.setattr(rag_utils, "BLOB_STORE_DIR", str(tmp_path / "store" / ".blobs"))
+    # packs are collected as soon as they are unreferenced
+    monkeypatch.setattr(rag_utils, "PACK_GC_GRACE_SECONDS", -1)
+    return tmp_path
+
+
+def _records(*texts):
+    return [Record(text, {"source": f"https://example.com/{text}"}) for text in texts]
+
+
+def _agent(tmp_path, name, records):
+    agent_dir = tmp_path / name
+    agent_dir.mkdir(parents=True)
+    stored = rag_utils.write_chunk_store(str(agent_dir), rag_utils.CHUNKS_STORE, records)
+    return str(agent_dir), stored
+
+
+def _pack_files(tmp_path):
+    return sorted(os.listdir(tmp_path / "store" / ".blobs" / rag_utils.PACKS_DIR))
+
+
+def test_shared_records_are_stored_once(blob_store):
+    first, stored = _agent(blob_store, "agent1", _records("a", "b", "c"))
+    assert stored == 3
+    second, stored = _agent(blob_store, "agent2", _records("a", "b", "c", "d", "d"))
+    assert stored == 1
+
+    assert list(ChunkStore(first, rag_utils.CHUNKS_STORE)) == _records("a", "b", "c")
+    assert list(ChunkStore(second, rag_utils.CHUNKS_STORE)) == _records("a", "b", "c", "d", "d")
+    assert len([name for name in _pack_files(blob_store) if name.endswith(".hashes")]) == 2
+
+
+def test_vectors_are_embedded_once_per_record(blob_store):
+    embedded = []
+
+    def embed(texts):
+        embedded.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    first, _ = _agent(blob_store, "agent1", _records("a", "bb"))
+    assert ChunkStore(first, rag_utils.CHUNKS_STORE).vectors("model") is None
+    assert ChunkStore(first, rag_utils.CHUNKS_STORE).vectors("model", embed).tolist() == [[1.0, 1.0], [2.0, 1.0]]
+
+    second, _ = _agent(blob_store, "agent2", _records("bb", "ccc"))
+    assert ChunkStore(second, rag_utils.CHUNKS_STORE).vectors("model", embed).tolist() == [[2.0, 1.0], [3.0, 1.0]]
+    assert embedded == ["a", "bb", "ccc"]
+    # vectors are kept per embedding model
+    assert ChunkStore(second, rag_utils.CHUNKS_STORE).vectors("models/other") is None
+
+
+def test_gc_keeps_registered_agents_anywhere(blob_store):
+    # an agent outside the blob store's parent directory, like create.py's default --output-dir
+    outside, _ = _agent(blob_store, "examples/test", _records("a", "b"))
+    inside, _ = _agent(blob_store, "store/agent1", _records("b", "c"))
+
+    rag_utils.collect_garbage()
+    assert list(ChunkStore(outside, rag_utils.CHUNKS_STORE)) == _records("a", "b")
+    assert list(ChunkStore(inside, rag_utils.CHUNKS_STORE)) == _records("b", "c")
+
+
+def test_gc_frees_packs_of_deleted_agents(blob_store):
+    first, _ = _agent(blob_store, "agent1", _records("a"))
+    second, _ = _agent(blob_store, "agent2", _records("a", "b"))
+    ChunkStore(second, rag_utils.CHUNKS_STORE).vectors("model", lambda texts: [[1.0]] * len(texts))
+    before = _pack_files(blob_store)
+
+    rag_utils.delete_agent(second)
+    assert not os.path.exists(second)
+    assert rag_utils.collect_garbage() > 0
+    after = _pack_files(blob_store)
+    assert len(after) < len(before)
+    # the vectors of the freed pack go with it, those of the shared pack stay
+    assert len([name for name in after if name.endswith(".vectors.npy")]) == 1
+    assert list(ChunkStore(first, rag_utils.CHUNKS_STORE)) == _records("a")
+
+
+def test_moved_agent_stays_registered(blob_store):
+    building, _ = _agent(blob_store, "agent1.building", _records("a"))
+    target = str(blob_store / "agent1")
+    rag_utils.move_agent(building, target)
+
+    rag_utils.collect_garbage()
+    assert list(ChunkStore(target, rag_utils.CHUNKS_STORE)) == _records("a")
+    assert list(rag_utils.registered_agents()) == [os.path.abspath(target)]